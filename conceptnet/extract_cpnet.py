@@ -1,5 +1,7 @@
 import configparser
+import itertools
 import json
+import multiprocessing
 
 relation_mapping = dict()
 
@@ -29,54 +31,111 @@ def del_pos(s):
     return s
 
 
-def extract_english():
+def iter_line_chunks(path, chunk_size=1 << 24):
+    """
+    Reads a file in large binary chunks, each ending at a line boundary.
+    """
+    with open(path, "rb") as f:
+        rest = b""
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            block = rest + block
+            cut = block.rfind(b"\n") + 1
+            if cut == 0:
+                rest = block
+                continue
+            rest = block[cut:]
+            yield block[:cut]
+        if rest:
+            yield rest
+
+
+def parse_weight(edge_info):
+    """
+    The "weight" of an edge's JSON info, as str(json.loads(edge_info)["weight"]), without parsing the rest.
+    """
+    pos = edge_info.rfind(b'"weight":')  # the last key of the (sorted) info dict
+    if pos < 0:
+        return str(json.loads(edge_info)["weight"])
+    end = pos + len(b'"weight":')
+    stop = end
+    while stop < len(edge_info) and edge_info[stop:stop + 1] not in b",}":
+        stop += 1
+    return str(json.loads(edge_info[end:stop]))
+
+
+def extract_chunk(chunk):
+    """
+    Extracts the English relations of a chunk of raw lines; returns the output lines, utf8-encoded.
+    """
+    only_english = []
+    for line in chunk.split(b"\n"):
+        if line.find(b"\t/c/en/") < 0:  # cheap byte-level filter: most assertions are not English
+            continue
+        ls = line.split(b"\t")
+        if ls[2].startswith(b"/c/en/") and ls[3].startswith(b"/c/en/"):
+            """
+            Some preprocessing:
+                - Remove part-of-speech encoding.
+                - Split("/")[-1] to trim the "/c/en/" and just get the entity name, convert all to 
+                - Lowercase for uniformity.
+            """
+            rel = ls[1].decode("utf8").split("/")[-1].lower()
+            head = del_pos(ls[2].decode("utf8")).split("/")[-1].lower()
+            tail = del_pos(ls[3].decode("utf8")).split("/")[-1].lower()
+
+            if not head.replace("_", "").replace("-", "").isalpha():
+                continue
+
+            if not tail.replace("_", "").replace("-", "").isalpha():
+                continue
+
+            if rel not in relation_mapping:
+                continue
+            rel = relation_mapping[rel]
+            if rel.startswith("*"):
+                rel = rel[1:]
+                tmp = head
+                head = tail
+                tail = tmp
+
+            only_english.append("\t".join([rel, head, tail, parse_weight(ls[4])]))
+    return "\n".join(only_english).encode("utf8")
+
+
+def extract_english(num_workers=None, chunk_size=1 << 24):
     """
     Reads original conceptnet csv file and extracts all English relations (head and tail are both English entities) into
     a new file, with the following format for each line: <relation> <head> <tail> <weight>.
+    The csv is streamed in chunks that are parsed in parallel and written in order as they finish, so memory stays
+    at a few chunks per worker.
     :return:
     """
     config = configparser.ConfigParser()
     config.read("paths.cfg")
 
-    only_english = []
-    with open(config["paths"]["conceptnet"], encoding="utf8") as f:
-        for line in f.readlines():
-            ls = line.split('\t')
-            if ls[2].startswith('/c/en/') and ls[3].startswith('/c/en/'):
-                """
-                Some preprocessing:
-                    - Remove part-of-speech encoding.
-                    - Split("/")[-1] to trim the "/c/en/" and just get the entity name, convert all to 
-                    - Lowercase for uniformity.
-                """
-                rel = ls[1].split("/")[-1].lower()
-                head = del_pos(ls[2]).split("/")[-1].lower()
-                tail = del_pos(ls[3]).split("/")[-1].lower()
-
-                if not head.replace("_", "").replace("-", "").isalpha():
+    num_workers = num_workers or multiprocessing.cpu_count()
+    window = 2 * num_workers  # chunks in flight
+    first = True
+    with multiprocessing.get_context("fork").Pool(num_workers) as p, \
+            open(config["paths"]["conceptnet_en"], "wb") as fo:
+        chunks = iter_line_chunks(config["paths"]["conceptnet"], chunk_size)
+        while True:
+            batch = list(itertools.islice(chunks, window))
+            if not batch:
+                break
+            for out in p.map(extract_chunk, batch):
+                if not out:
                     continue
-
-                if not tail.replace("_", "").replace("-", "").isalpha():
-                    continue
-
-                if rel not in relation_mapping:
-                    continue
-                rel = relation_mapping[rel]
-                if rel.startswith("*"):
-                    rel = rel[1:]
-                    tmp = head
-                    head = tail
-                    tail = tmp
-
-                data = json.loads(ls[4])
-
-                only_english.append("\t".join([rel, head, tail, str(data["weight"])]))
-
-    with open(config["paths"]["conceptnet_en"], "w", encoding="utf8") as f:
-        f.write("\n".join(only_english))
+                if not first:
+                    fo.write(b"\n")  # lines are joined by newlines, no trailing one
+                fo.write(out)
+                first = False
 
 
 if __name__ == "__main__":
-    load_merge_relation()
+    load_merge_relation()  # before the pool forks, so the workers share relation_mapping
     print(relation_mapping)
-    extract_english()
\ No newline at end of file
+    extract_english()
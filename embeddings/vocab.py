@@ -0,0 +1,174 @@
+"""
+Compact, memory-mappable vocabularies (concept.txt, relation.txt) shared by all pipeline stages.
+
+The first load of a vocab file `concept.txt` builds, next to it:
+    concept.txt.vocab.blob.npy     uint8  utf8 bytes of all words, in id order
+    concept.txt.vocab.offsets.npy  int64  [num_words + 1]  word i is blob[offsets[i]:offsets[i+1]]
+    concept.txt.vocab.sorted.npy   int32  [num_words]      ids sorted by word (byte order), for binary search
+Later loads only memory-map these, so forked workers share the pages and startup does not build two
+800k-entry dicts per process.
+
+`vocab.word2id` and `vocab.id2word` behave like the old concept2id / id2concept dicts for lookups
+(`[]`, `in`, `get`, `len`). A word -> id lookup is a binary search (~20 us on 800k concepts); single-process
+stages that look up every concept of a split build a plain dict once with `vocab.to_dict()` instead
+(~1 s and ~100 MB for 800k concepts, ~1 us per lookup), which pays off after ~50k lookups.
+"""
+
+import os
+
+import numpy as np
+
+
+VOCAB_ARRAYS = ["blob", "offsets", "sorted"]
+
+
+def vocab_file(prefix, name):
+    return "%s.%s.npy" % (prefix, name)
+
+
+def build_vocab(path, prefix):
+    """
+    Packs a one-word-per-line vocab file (ids are line numbers) into the arrays above.
+    """
+    with open(path, "r", encoding="utf8") as f:
+        save_vocab([w.strip() for w in f.readlines()], prefix)
+
+
+def save_vocab(words, prefix):
+    """
+    Packs a list of words (ids are list positions) into the arrays above, e.g. for vocabularies that only
+    exist in memory. Load them with `Vocab(prefix)`.
+    """
+    words = [w.encode("utf8") for w in words]
+    offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum([len(w) for w in words], out=offsets[1:])
+    blob = np.frombuffer(b"".join(words), dtype=np.uint8)
+    sorted_ids = np.array(sorted(range(len(words)), key=words.__getitem__), dtype=np.int32)
+    for name, arr in [("blob", blob), ("offsets", offsets), ("sorted", sorted_ids)]:
+        # other processes may be loading (or packing) the same vocab: write a file of our own, then rename
+        tmp = "%s.%d.tmp.npy" % (vocab_file(prefix, name), os.getpid())
+        np.save(tmp, arr)
+        os.replace(tmp, vocab_file(prefix, name))
+
+
+def load_vocab(path, mmap_mode="r"):
+    """
+    :param path: the vocab text file, e.g. config["paths"]["concept_vocab"]. Its packed arrays are (re)built
+    if missing or older than the file.
+    """
+    prefix = path + ".vocab"
+    if not all(os.path.exists(vocab_file(prefix, name)) and
+               os.path.getmtime(vocab_file(prefix, name)) >= os.path.getmtime(path) for name in VOCAB_ARRAYS):
+        print("packing vocab %s" % path)
+        build_vocab(path, prefix)
+    return Vocab(prefix, mmap_mode)
+
+
+class Vocab(object):
+    """
+    id -> word by indexing (`vocab[i]`), word -> id by binary search over the sorted ids (`vocab.index(w)`).
+    """
+
+    def __init__(self, prefix, mmap_mode="r"):
+        self.prefix = prefix
+        self.blob = np.load(vocab_file(prefix, "blob"), mmap_mode=mmap_mode)
+        self.offsets = np.load(vocab_file(prefix, "offsets"), mmap_mode=mmap_mode)
+        self.sorted_ids = np.load(vocab_file(prefix, "sorted"), mmap_mode=mmap_mode)
+        # memoryviews over the same pages: indexing them gives plain ints / bytes, far cheaper than numpy scalars
+        self._blob = memoryview(self.blob)
+        self._offsets = memoryview(self.offsets)
+        self._sorted_ids = memoryview(self.sorted_ids)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _word_bytes(self, i):
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise KeyError(i)
+        return self._word_bytes(int(i)).decode("utf8")
+
+    def __iter__(self):
+        blob = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        for lo, hi in zip(offsets[:-1], offsets[1:]):
+            yield blob[lo:hi].decode("utf8")
+
+    def _find(self, word):
+        key = word.encode("utf8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word_bytes(self._sorted_ids[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._word_bytes(self._sorted_ids[lo]) == key:
+            return self._sorted_ids[lo]
+        return -1
+
+    def index(self, word):
+        i = self._find(word)
+        if i < 0:
+            raise KeyError(word)
+        return i
+
+    def __contains__(self, word):
+        return isinstance(word, str) and self._find(word) >= 0
+
+    def ids(self, words):
+        """
+        Ids of many words (-1 for unknown ones), looking up every distinct word once.
+        """
+        memo = {}
+        for w in words:
+            if w not in memo:
+                memo[w] = self._find(w)
+        return np.array([memo[w] for w in words], dtype=np.int64)
+
+    def to_dict(self):
+        """
+        word -> id as a plain dict, for bulk lookups (see above).
+        """
+        return {w: i for i, w in enumerate(self)}
+
+    @property
+    def id2word(self):
+        return self
+
+    @property
+    def word2id(self):
+        return VocabIndex(self)
+
+
+class VocabIndex(object):
+    """
+    Read-only word -> id mapping over a Vocab, a drop-in for the old concept2id / relation2id dicts.
+    """
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __getitem__(self, word):
+        return self.vocab.index(word)
+
+    def __contains__(self, word):
+        return word in self.vocab
+
+    def get(self, word, default=None):
+        i = self.vocab._find(word)
+        return default if i < 0 else i
+
+    def __iter__(self):
+        return iter(self.vocab)
+
+    def keys(self):
+        return iter(self.vocab)
+
+    def items(self):
+        return ((w, i) for i, w in enumerate(self.vocab))
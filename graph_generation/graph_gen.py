@@ -9,9 +9,15 @@ import sys
 import time
 import timeit
 import pickle
+import os
 
 
 import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+from pathfinder.cpnet_graph import CPNetGraph, CPNetSimpleGraph
+from pathfinder.pf_store import load_pf
+from grounding.mcp_store import load_mcp, statement_concept_ids
 
 split = sys.argv[1]
 
@@ -19,7 +25,8 @@ config = configparser.ConfigParser()
 config.read("paths.cfg")
 
 GRAPH_PATH = "../datasets/csqa_new/%s_rand_split.jsonl.statements.pruned.0.15.pnxg"%split
-PF_PATH = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf.cls.pruned.0.15.pickle"%split
+PF_PATH = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf"%split
+PF_THRESHOLD = 0.15  # paths scoring below it are pruned when loading
 MCP_PATH = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp"%split
 
 NUM_CHOICES = 5
@@ -36,55 +43,34 @@ pf_data = None
 
 def load_resources():
     global concept2id, relation2id, id2relation, id2concept, mcp_data, pf_data, PF_PATH, MCP_PATH
-    concept2id = {}
-    id2concept = {}
-    with open(config["paths"]["concept_vocab"], "r", encoding="utf8") as f:
-        for w in f.readlines():
-            concept2id[w.strip()] = len(concept2id)
-            id2concept[len(id2concept)] = w.strip()
+    concept_vocab = load_vocab(config["paths"]["concept_vocab"])
+    concept2id, id2concept = concept_vocab.to_dict(), concept_vocab.id2word  # JSON .mcp: one lookup per concept
 
     print("concept2id done")
-    id2relation = {}
-    relation2id = {}
-    with open(config["paths"]["relation_vocab"], "r", encoding="utf8") as f:
-        for w in f.readlines():
-            id2relation[len(id2relation)] = w.strip()
-            relation2id[w.strip()] = len(relation2id)
+    relation_vocab = load_vocab(config["paths"]["relation_vocab"])
+    relation2id, id2relation = relation_vocab.word2id, relation_vocab.id2word
     print("relation2id done")
 
     print("loading pf_data from %s" % PF_PATH)
     start_time = timeit.default_timer()
-    with open(PF_PATH, "rb") as fi:
-        pf_data = pickle.load(fi)
+    pf_data = load_pf(PF_PATH, threshold=PF_THRESHOLD)
     print('\t Done! Time: ', "{0:.2f} sec".format(float(timeit.default_timer() - start_time)))
 
-    with open(MCP_PATH, "r") as f:
-        mcp_data = json.load(f)
+    mcp_data = load_mcp(MCP_PATH, concept_vocab)
 
 
 
 def load_cpnet():
     global cpnet,concept2id, relation2id, id2relation, id2concept, cpnet_simple
     print("loading cpnet....")
-    cpnet = nx.read_gpickle(config["paths"]["conceptnet_en_graph"])
+    cpnet = CPNetGraph(config["paths"]["conceptnet_en_csr"])
+    cpnet_simple = CPNetSimpleGraph(config["paths"]["conceptnet_en_csr"])  # saved by graph_construction.py
     print("Done")
 
-    cpnet_simple = nx.Graph()
-    for u, v, data in cpnet.edges(data=True):
-        w = data['weight'] if 'weight' in data else 1.0
-        if cpnet_simple.has_edge(u, v):
-            cpnet_simple[u][v]['weight'] += w
-        else:
-            cpnet_simple.add_edge(u, v, weight=w)
-
 
 def get_edge(src_concept, tgt_concept):
     global cpnet, concept2id, relation2id, id2relation, id2concept
-    rel_list = cpnet[src_concept][tgt_concept]
-    # tmp = [rel_list[item]["weight"] for item in rel_list]
-    # s = tmp.index(min(tmp))
-    # rel = rel_list[s]["rel"]
-    return list(set([rel_list[item]["rel"] for item in rel_list]))
+    return cpnet.relations(src_concept, tgt_concept)
 
 
 # plain graph generation
@@ -96,11 +82,15 @@ def plain_graph_generation(qcs, acs, paths, rels):
     # print("rels", rels)
 
     graph = nx.Graph()
+    seen_edges = set()  # (h, t) hops already added; paths of a statement share most of their hops
     for index, p in enumerate(paths):
 
         for c_index in range(len(p)-1):
             h = p[c_index]
             t = p[c_index+1]
+            if (h, t) in seen_edges:
+                continue
+            seen_edges.add((h, t))
             # TODO: the weight can computed by concept embeddings and relation embeddings of TransE
             graph.add_edge(h,t, weight=1.0)
 
@@ -137,21 +127,20 @@ def relational_graph_generation(qcs, acs, paths, rels):
     # print("rels", rels)
 
     graph = nx.MultiDiGraph()
+    edge_rels = {}  # (h, t) -> relations already on that edge, instead of re-reading them from the graph
     for index, p in enumerate(paths):
         rel_list = rels[index]
         for c_index in range(len(p)-1):
             h = p[c_index]
             t = p[c_index+1]
-            if graph.has_edge(h,t):
-                existing_r_set = set([graph[h][t][r]["rel"] for r in graph[h][t]])
-            else:
-                existing_r_set = set()
+            existing_r_set = edge_rels.setdefault((h, t), set())
             for r in rel_list[c_index]:
                 # TODO: the weight can computed by concept embeddings and relation embeddings of TransE
                 # TODO: do we need to add both directions?
                 if r in existing_r_set:
                     continue
                 graph.add_edge(h,t, rel=r, weight=1.0)
+            existing_r_set.update(rel_list[c_index])
 
     for qc1, qc2 in list(itertools.combinations(qcs, 2)):
         if cpnet_simple.has_edge(qc1, qc2):
@@ -202,8 +191,7 @@ def main():
             statement_paths.extend(cur_paths)
             statement_rel_list.extend(cur_rels)
 
-        qcs = [concept2id[c] for c in mcp_data[index]["qc"]]
-        acs = [concept2id[c] for c in mcp_data[index]["ac"]]
+        qcs, acs = statement_concept_ids(mcp_data, index, concept2id)
 
         gstr = plain_graph_generation(qcs=qcs, acs=acs,
                             paths=statement_paths,
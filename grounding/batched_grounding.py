@@ -2,6 +2,8 @@ import sys
 import json
 import random
 
+from mcp_store import save_mcp, load_concept_vocab
+
 path_csqa_train = "../datasets/csqa_new/train_rand_split.jsonl.statements"
 path_csqa_dev = "../datasets/csqa_new/dev_rand_split.jsonl.statements"
 path_swag_train = "../datasets/swagaf/data/train.statements"
@@ -34,13 +36,8 @@ def combine():
         with open(PATH + ".%d.mcp"%i) as fp:
             tmp_list = json.load(fp)
         final_json += tmp_list
-    import jsbeautifier
-    opts = jsbeautifier.default_options()
-    opts.indent_size = 2
-
-
-    with open(PATH + ".mcp", 'w') as fp:
-        fp.write(jsbeautifier.beautify(json.dumps(final_json), opts))
+    # packed store (see mcp_store.py); `python mcp_store.py to_json` gives a readable copy
+    save_mcp(PATH + ".mcp", final_json, load_concept_vocab())
 
 
 if __name__ == '__main__':
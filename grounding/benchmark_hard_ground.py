@@ -0,0 +1,57 @@
+"""
+Micro-benchmark of the hard_ground fallback: the old version (re-parses the sentence, scans a list of the
+space-joined vocab for every token) against the set-based one on the already parsed doc.
+"""
+
+import os
+import sys
+import timeit
+import configparser
+
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+from grounding_concepts import load_nlp, read_statements, hard_ground
+
+
+def list_hard_ground(nlp, sent, vocab_list):
+    # hard_ground before the hashed vocab index, for reference
+    sent = sent.lower()
+    doc = nlp(sent)
+    res = set()
+    for t in doc:
+        if t.lemma_ in vocab_list:
+            res.add(t.lemma_)
+    sent = "_".join([t.text for t in doc])
+    if sent in vocab_list:
+        res.add(sent)
+    return res
+
+
+def benchmark(filename, num_statements=10000, num_list_statements=200):
+    config = configparser.ConfigParser()
+    config.read("paths.cfg")
+    vocab_list = [c.replace("_", " ") for c in load_vocab(config["paths"]["concept_vocab"])]
+    nlp = load_nlp()
+    _, answers = read_statements(filename)  # answers are where the fallback is hit most
+    answers = answers[:num_statements]
+    docs = list(tqdm(nlp.pipe([a.lower() for a in answers], batch_size=1000), total=len(answers), desc="parsing"))
+
+    start_time = timeit.default_timer()
+    old_res = [list_hard_ground(nlp, a, vocab_list) for a in answers[:num_list_statements]]
+    old_time = (timeit.default_timer() - start_time) / max(len(old_res), 1)
+    start_time = timeit.default_timer()
+    new_res = [hard_ground(nlp, a, doc=doc) for a, doc in zip(answers, docs)]
+    new_time = (timeit.default_timer() - start_time) / max(len(new_res), 1)
+
+    # the old version never found multi-word concepts: it looked up "_"-joined text in the space-joined list
+    num_diff = sum(o != n for o, n in zip(old_res, new_res))
+    print("list + re-parse: %.1f us / call (%d calls)" % (old_time * 1e6, len(old_res)))
+    print("set + parsed doc: %.1f us / call (%d calls)" % (new_time * 1e6, len(new_res)))
+    print("different results: %d / %d" % (num_diff, len(old_res)))
+
+
+# python benchmark_hard_ground.py ../datasets/csqa_new/dev_rand_split.jsonl.statements
+if __name__ == "__main__":
+    benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
@@ -0,0 +1,60 @@
+"""
+Startup time and match parity of the prebuilt lemma trie (lemma_matcher.py) against the spaCy Matcher that
+grounding_concepts.load_matcher builds from matcher_patterns.
+"""
+
+import sys
+import json
+import timeit
+import configparser
+
+from tqdm import tqdm
+
+from grounding_concepts import load_nlp, load_matcher, read_statements
+from lemma_matcher import build_lemma_trie, is_lemma_trie, load_lemma_trie
+
+
+def benchmark(filename, num_statements=10000):
+    config = configparser.ConfigParser()
+    config.read("paths.cfg")
+    nlp = load_nlp()
+
+    start_time = timeit.default_timer()
+    matcher = load_matcher(nlp, use_trie=False)
+    matcher_startup = timeit.default_timer() - start_time
+
+    trie_path = config["paths"]["matcher_trie"]
+    if not is_lemma_trie(trie_path):
+        with open(config["paths"]["matcher_patterns"], "r", encoding="utf8") as f:
+            build_lemma_trie(json.load(f), trie_path)
+    start_time = timeit.default_timer()
+    trie = load_lemma_trie(trie_path)
+    trie_startup = timeit.default_timer() - start_time
+
+    sents, answers = read_statements(filename)
+    texts = [t.lower() for s, a in zip(sents[:num_statements], answers[:num_statements]) for t in (s, a)]
+    docs = list(tqdm(nlp.pipe(texts, batch_size=1000), total=len(texts), desc="parsing"))
+
+    start_time = timeit.default_timer()
+    matcher_res = [[(nlp.vocab.strings[m], s, e) for m, s, e in matcher(doc)] for doc in docs]
+    matcher_time = timeit.default_timer() - start_time
+    start_time = timeit.default_timer()
+    trie_res = [trie(doc) for doc in docs]
+    trie_time = timeit.default_timer() - start_time
+
+    num_diff = 0
+    for text, m, t in zip(texts, matcher_res, trie_res):
+        if m != t:
+            num_diff += 1
+            if num_diff <= 5:
+                print("mismatch on %r:\n\tMatcher: %s\n\ttrie:    %s" % (text, m, t))
+
+    print("patterns: %d" % len(trie))
+    print("startup:  Matcher %.2f sec, trie %.2f sec" % (matcher_startup, trie_startup))
+    print("matching %d docs: Matcher %.2f sec, trie %.2f sec" % (len(docs), matcher_time, trie_time))
+    print("docs with different matches: %d / %d" % (num_diff, len(docs)))
+
+
+# python benchmark_matcher.py ../datasets/csqa_new/dev_rand_split.jsonl.statements 10000
+if __name__ == "__main__":
+    benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
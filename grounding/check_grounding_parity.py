@@ -0,0 +1,60 @@
+"""
+Grounds the same statements with the spaCy pipeline and with the spaCy-free lemma table (lemma_table.py) and
+reports how often the question / answer concepts differ, and the throughput of both.
+"""
+
+import os
+import sys
+import json
+import timeit
+import configparser
+
+from grounding_concepts import load_nlp, match_mentioned_concepts, read_statements
+from lemma_table import build_word_lemmas
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if len(a | b) > 0 else 1.0
+
+
+def check(filename, num_statements=10000):
+    config = configparser.ConfigParser()
+    config.read("paths.cfg")
+    sents, answers = read_statements(filename)
+    sents, answers = sents[:num_statements], answers[:num_statements]
+
+    nlp = load_nlp()
+    if not os.path.exists(config["paths"]["word_lemmas"]):
+        with open(config["paths"]["word_lemmas"], "w", encoding="utf8") as f:
+            json.dump(build_word_lemmas(nlp, [t.lower() for t in sents + answers]), f)
+
+    start_time = timeit.default_timer()
+    spacy_res = match_mentioned_concepts(nlp, sents, answers)
+    spacy_time = timeit.default_timer() - start_time
+    table_nlp = load_nlp(lemma_table=True)
+    start_time = timeit.default_timer()
+    table_res = match_mentioned_concepts(table_nlp, sents, answers)
+    table_time = timeit.default_timer() - start_time
+
+    num_same = {"qc": 0, "ac": 0}
+    sum_jaccard = {"qc": 0.0, "ac": 0.0}
+    num_printed = 0
+    for r1, r2 in zip(spacy_res, table_res):
+        for key in ["qc", "ac"]:
+            c1, c2 = set(r1[key]), set(r2[key])
+            num_same[key] += c1 == c2
+            sum_jaccard[key] += jaccard(c1, c2)
+            if c1 != c2 and num_printed < 10:
+                num_printed += 1
+                print("%s differs on %r:\n\tspaCy: %s\n\ttable: %s" % (key, r1["sent"], sorted(c1), sorted(c2)))
+
+    n = len(spacy_res)
+    for key in ["qc", "ac"]:
+        print("%s: identical for %d / %d statements (%.4f), mean jaccard %.4f" % (
+            key, num_same[key], n, num_same[key] / max(n, 1), sum_jaccard[key] / max(n, 1)))
+    print("throughput: spaCy %.0f statements/sec, table %.0f statements/sec" % (n / spacy_time, n / table_time))
+
+
+# python check_grounding_parity.py ../datasets/csqa_new/dev_rand_split.jsonl.statements 10000
+if __name__ == "__main__":
+    check(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
@@ -4,6 +4,11 @@ import spacy
 from spacy.matcher import Matcher
 from tqdm import tqdm
 import nltk
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+from lemma_matcher import build_lemma_trie
 # print('NLTK Version: %s' % (nltk.__version__))
 nltk.download('stopwords')
 nltk_stopwords = nltk.corpus.stopwords.words('english')
@@ -24,11 +29,7 @@ def create_matcher_patterns():
     config = configparser.ConfigParser()
     config.read("paths.cfg")
 
-    with open(config["paths"]["concept_vocab"], "r", encoding="utf8") as f:
-        cpnet_vocab = [l.strip() for l in list(f.readlines())]
-
-
-    cpnet_vocab = [c.replace("_", " ") for c in cpnet_vocab]
+    cpnet_vocab = [c.replace("_", " ") for c in load_vocab(config["paths"]["concept_vocab"])]
 
 
     nlp = spacy.load('en_core_web_sm', disable=['parser', 'ner', 'textcat'])
@@ -36,9 +37,12 @@ def create_matcher_patterns():
     docs = nlp.pipe(cpnet_vocab)
 
     all_patterns = {}
+    concept_lemmas = {}  # lemma cache of grounding_concepts.lemmatize, for every concept
 
     for doc in tqdm(docs, total=len(cpnet_vocab)):
 
+        concept_lemmas["_".join(doc.text.split(" "))] = "_".join([token.lemma_ for token in doc])
+
         pattern = create_pattern(nlp, doc)
 
         if pattern is None:
@@ -50,6 +54,11 @@ def create_matcher_patterns():
     with open(config["paths"]["matcher_patterns"], "w", encoding="utf8") as f:
         json.dump(all_patterns, f)
 
+    with open(config["paths"]["concept_lemmas"], "w", encoding="utf8") as f:
+        json.dump(concept_lemmas, f)
+
+    build_lemma_trie(all_patterns, config["paths"]["matcher_trie"])
+
 
 if __name__ == "__main__":
     create_matcher_patterns()
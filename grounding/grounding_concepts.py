@@ -1,28 +1,42 @@
 import configparser
 import json
-import spacy
-from spacy.matcher import Matcher
+from functools import lru_cache
 import sys
 import timeit
 from tqdm import tqdm
 import numpy as np
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+from lemma_matcher import is_lemma_trie, load_lemma_trie
+from lemma_table import LemmaTableNLP, load_word_lemmas
+from prune_qc import load_stop_flags, prune_item
 blacklist = set(["-PRON-", "actually", "likely", "possibly", "want",
                  "make", "my", "someone", "sometimes_people", "sometimes","would", "want_to",
                  "one", "something", "sometimes", "everybody", "somebody", "could", "could_be"
                  ])
 
 
-concept_vocab = set()
 config = configparser.ConfigParser()
 config.read("paths.cfg")
-with open(config["paths"]["concept_vocab"], "r", encoding="utf8") as f:
-    cpnet_vocab = [l.strip() for l in list(f.readlines())]
-cpnet_vocab = [c.replace("_", " ") for c in cpnet_vocab]
+cpnet_vocab = {c: i for i, c in enumerate(load_vocab(config["paths"]["concept_vocab"]))}  # hashed, concepts joined with "_"
 
-def lemmatize(nlp, concept):
+concept_lemmas = None  # concept -> lemma, precomputed for the whole vocab by create_patterns.py
+
+
+def load_lemma_cache():
+    global concept_lemmas
+    path = config["paths"]["concept_lemmas"]
+    if not os.path.exists(path):
+        print("no lemma cache at %s (run create_patterns.py), lemmatizing on the fly" % path)
+        concept_lemmas = {}
+        return
+    with open(path, "r", encoding="utf8") as f:
+        concept_lemmas = json.load(f)
 
+@lru_cache(maxsize=1 << 16)
+def lemmatize_uncached(nlp, concept):
     doc = nlp(concept.replace("_"," "))
-    lcs = set()
     # for i in range(len(doc)):
     #     lemmas = []
     #     for j, token in enumerate(doc):
@@ -32,12 +46,26 @@ def lemmatize(nlp, concept):
     #             lemmas.append(token.text)
     #     lc = "_".join(lemmas)
     #     lcs.add(lc)
-    lcs.add("_".join([token.lemma_ for token in doc])) # all lemma
-    return lcs
+    return "_".join([token.lemma_ for token in doc]) # all lemma
 
-def load_matcher(nlp):
+def lemmatize(nlp, concept):
+    lemma = concept_lemmas.get(concept) if concept_lemmas is not None else None
+    if lemma is None:
+        lemma = lemmatize_uncached(nlp, concept)  # not a vocab concept, e.g. the lemma of one
+    return set([lemma])
+
+def load_matcher(nlp, use_trie=True):
+    """
+    The prebuilt lemma trie of create_patterns.py if there is one (loads in seconds), else a spaCy Matcher
+    filled with all patterns.
+    """
     config = configparser.ConfigParser()
     config.read("paths.cfg")
+    if use_trie and is_lemma_trie(config["paths"]["matcher_trie"]):
+        return load_lemma_trie(config["paths"]["matcher_trie"])
+    if isinstance(nlp, LemmaTableNLP):
+        raise ValueError("grounding without spaCy needs the lemma trie, run create_patterns.py or lemma_matcher.py")
+    from spacy.matcher import Matcher
     with open(config["paths"]["matcher_patterns"], "r", encoding="utf8") as f:
         all_patterns = json.load(f)
 
@@ -46,9 +74,13 @@ def load_matcher(nlp):
         matcher.add(concept, None, pattern)
     return matcher
 
-def ground_mentioned_concepts(nlp, matcher, s, ans = ""):
+def ground_mentioned_concepts(nlp, matcher, s, ans = "", doc = None):
+    """
+    :param doc: nlp(s.lower()) if it is already parsed (see match_mentioned_concepts).
+    """
     s = s.lower()
-    doc = nlp(s)
+    if doc is None:
+        doc = nlp(s)
     matches = matcher(doc)
 
     mentioned_concepts = set()
@@ -59,7 +91,8 @@ def ground_mentioned_concepts(nlp, matcher, s, ans = ""):
         span = doc[start:end].text  # the matched span
         if len(set(span.split(" ")).intersection(set(ans.split(" ")))) > 0:
             continue
-        original_concept = nlp.vocab.strings[match_id]
+        # the lemma trie gives the concept itself, the spaCy Matcher its hash
+        original_concept = match_id if isinstance(match_id, str) else nlp.vocab.strings[match_id]
         # print("Matched '" + span + "' to the rule '" + string_id)
 
         if len(original_concept.split("_")) == 1:
@@ -97,46 +130,79 @@ def ground_mentioned_concepts(nlp, matcher, s, ans = ""):
     #     print()
     return mentioned_concepts
 
-def hard_ground(nlp, sent):
-    global cpnet_vocab
+def in_cpnet_vocab(concept):
+    """
+    Whether a concept is in the vocab, given with "_" (like the vocab) or with spaces between its words.
+    """
+    return concept.replace(" ", "_") in cpnet_vocab
+
+def hard_ground(nlp, sent, doc = None):
+    """
+    Fallback when the matcher finds nothing: every token lemma in the vocab, and the whole sentence.
+    :param doc: nlp(sent.lower()) if it is already parsed.
+    """
     sent = sent.lower()
-    doc = nlp(sent)
+    if doc is None:
+        doc = nlp(sent)
     res = set()
     for t in doc:
-        if t.lemma_ in cpnet_vocab:
-            res.add(t.lemma_)
+        if in_cpnet_vocab(t.lemma_):
+            res.add(t.lemma_.replace(" ", "_"))
     sent = "_".join([t.text for t in doc])
-    if sent in cpnet_vocab:
+    if in_cpnet_vocab(sent):
         res.add(sent)
     return res
 
-def match_mentioned_concepts(nlp, sents, answers, batch_id = -1):
+def match_mentioned_concepts(nlp, sents, answers, batch_id = -1, n_process = 1, batch_size = 1000, prune = True):
+    """
+    Statements and answers are streamed through nlp.pipe (batched, over n_process processes) and the matcher
+    runs on the parsed docs in this process.
+    :param prune: apply the rules of prune_qc.py to the concepts of each statement (on by default, so the
+    pipeline no longer runs prune_qc.py; running it on pruned output changes nothing).
+    """
     matcher = load_matcher(nlp)
+    if concept_lemmas is None:
+        load_lemma_cache()
+    if prune:
+        stop_flags = load_stop_flags(config["paths"]["concept_vocab"])
+
+    # one stream alternating statement, answer, statement, ..., so consecutive docs pair up with (s, a)
+    texts = (t.lower() for s, a in zip(sents, answers) for t in (s, a))
+    docs = iter(nlp.pipe(texts, batch_size=batch_size, n_process=n_process))
 
     res = []
     # print("Begin matching concepts.")
-    for sid, s in tqdm(enumerate(sents), total=len(sents), desc="grounding batch_id:%d"%batch_id):
-        a = answers[sid]
-        all_concepts = ground_mentioned_concepts(nlp, matcher, s, a)
-        answer_concepts = ground_mentioned_concepts(nlp, matcher, a)
+    for s, a, s_doc, a_doc in tqdm(zip(sents, answers, docs, docs), total=len(sents), desc="grounding batch_id:%d"%batch_id):
+        all_concepts = ground_mentioned_concepts(nlp, matcher, s, a, doc=s_doc)
+        answer_concepts = ground_mentioned_concepts(nlp, matcher, a, doc=a_doc)
         question_concepts = all_concepts - answer_concepts
         if len(question_concepts)==0:
             # print(s)
-            question_concepts = hard_ground(nlp, s) # not very possible
+            question_concepts = hard_ground(nlp, s, doc=s_doc) # not very possible
         if len(answer_concepts)==0:
             print(a)
-            answer_concepts = hard_ground(nlp, a) # some case
+            answer_concepts = hard_ground(nlp, a, doc=a_doc) # some case
             print(answer_concepts)
 
-        res.append({"sent": s, "ans": a, "qc": list(question_concepts), "ac": list(answer_concepts)})
+        item = {"sent": s, "ans": a, "qc": list(question_concepts), "ac": list(answer_concepts)}
+        if prune:
+            item = prune_item(item, cpnet_vocab, stop_flags)
+        res.append(item)
     return res
 
-def process(filename, batch_id=-1):
-
-
+def load_nlp(lemma_table=False):
+    """
+    :param lemma_table: tokenize and lemmatize with the precomputed word -> lemma table instead of spaCy
+    (see lemma_table.py).
+    """
+    if lemma_table:
+        return LemmaTableNLP(load_word_lemmas(config["paths"]["word_lemmas"]))
+    import spacy
     nlp = spacy.load('en_core_web_sm', disable=['ner', 'parser', 'textcat'])
     nlp.add_pipe(nlp.create_pipe('sentencizer'))
+    return nlp
 
+def read_statements(filename):
     sents = []
     answers = []
     with open(filename, 'r') as f:
@@ -151,7 +217,14 @@ def process(filename, batch_id=-1):
             sents.append(statement["statement"])
         for answer in j["question"]["choices"]:
             answers.append(answer["text"])
+    return sents, answers
+
+def process(filename, batch_id=-1, n_process=1, lemma_table=False, prune=True):
+
 
+    nlp = load_nlp(lemma_table)
+
+    sents, answers = read_statements(filename)
 
     if batch_id >= 0:
         output_path = filename + ".%d.mcp" % batch_id
@@ -162,20 +235,24 @@ def process(filename, batch_id=-1):
         batch_sents = sents
         batch_answers = answers
 
-    res = match_mentioned_concepts(nlp, sents=batch_sents, answers=batch_answers, batch_id=batch_id)
+    res = match_mentioned_concepts(nlp, sents=batch_sents, answers=batch_answers, batch_id=batch_id, n_process=n_process,
+                                   prune=prune)
     with open(output_path, 'w') as fo:
         json.dump(res, fo)
 
 
 
 def test():
-    nlp = spacy.load('en_core_web_sm', disable=['ner', 'parser', 'textcat'])
-    nlp.add_pipe(nlp.create_pipe('sentencizer'))
+    nlp = load_nlp()
     res = match_mentioned_concepts(nlp, sents=["Sometimes people say that someone stupid has no swimming pool."], answers=["swimming pool"])
     print(res)
 
 # "sent": "Watch television do children require to grow up healthy.", "ans": "watch television",
+# python grounding_concepts.py ../datasets/csqa_new/train_rand_split.jsonl.statements -1 8
+# python grounding_concepts.py ../datasets/csqa_new/train_rand_split.jsonl.statements -1 1 table   (no spaCy)
+# python grounding_concepts.py ../datasets/csqa_new/train_rand_split.jsonl.statements -1 1 noprune   (unpruned qc/ac)
 if __name__ == "__main__":
-    process(sys.argv[1], int(sys.argv[2]))
+    process(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 1,
+            lemma_table="table" in sys.argv[4:], prune="noprune" not in sys.argv[4:])
 
 # test()
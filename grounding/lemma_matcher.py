@@ -0,0 +1,147 @@
+"""
+Prebuilt concept matcher: a trie over token lemmas, built once from matcher_patterns.
+
+Every pattern of create_patterns.py is a plain sequence of {"LEMMA": ...} tokens, so the spaCy Matcher that
+grounding used to fill with several hundred thousand `matcher.add` calls per process is equivalent to a trie
+whose edges are lemmas. The trie is saved as memory-mapped arrays under a prefix, e.g. "matcher_patterns.trie":
+
+    prefix.lemmas.*.npy           the lemma strings of all pattern tokens (embeddings/vocab.py layout)
+    prefix.concepts.*.npy         the pattern keys (concepts), in pattern order
+    prefix.child_offsets.npy      int64  [num_nodes + 1]  children of node n are child_*[child_offsets[n]:..]
+    prefix.child_lemmas.npy       int32  lemma id of each child edge, sorted within a node
+    prefix.child_nodes.npy        int32  node the edge leads to
+    prefix.output_offsets.npy     int64  [num_nodes + 1]  patterns ending at node n are outputs[output_offsets[n]:..]
+    prefix.outputs.npy            int32  concept (pattern) ids
+
+Node 0 is the root. Loading is a few np.load calls, and matching needs nothing but the token lemmas.
+"""
+
+import os
+import sys
+import json
+import configparser
+from bisect import bisect_left
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import Vocab, save_vocab
+
+
+TRIE_ARRAYS = ["child_offsets", "child_lemmas", "child_nodes", "output_offsets", "outputs"]
+
+
+def trie_file(prefix, name):
+    return "%s.%s.npy" % (prefix, name)
+
+
+def is_lemma_trie(prefix):
+    return os.path.exists(trie_file(prefix, "outputs"))
+
+
+def build_lemma_trie(all_patterns, prefix):
+    """
+    :param all_patterns: {concept: [{"LEMMA": lemma}, ...]}, the content of matcher_patterns.
+    """
+    lemma2id = {}
+    children = [{}]
+    outputs = [[]]
+    for k, (concept, pattern) in enumerate(tqdm(all_patterns.items(), desc="building lemma trie")):
+        node = 0
+        for token in pattern:
+            assert list(token.keys()) == ["LEMMA"], "only lemma sequences can be put in the trie: %s" % concept
+            lemma_id = lemma2id.setdefault(token["LEMMA"], len(lemma2id))
+            child = children[node].get(lemma_id)
+            if child is None:
+                child = len(children)
+                children[node][lemma_id] = child
+                children.append({})
+                outputs.append([])
+            node = child
+        outputs[node].append(k)
+
+    child_offsets = np.zeros(len(children) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in children], out=child_offsets[1:])
+    child_lemmas = np.array([l for c in children for l in sorted(c)], dtype=np.int32)
+    child_nodes = np.array([c[l] for c in children for l in sorted(c)], dtype=np.int32)
+    output_offsets = np.zeros(len(outputs) + 1, dtype=np.int64)
+    np.cumsum([len(o) for o in outputs], out=output_offsets[1:])
+    arrays = {"child_offsets": child_offsets, "child_lemmas": child_lemmas, "child_nodes": child_nodes,
+              "output_offsets": output_offsets, "outputs": np.array([k for o in outputs for k in o], dtype=np.int32)}
+
+    save_vocab(sorted(lemma2id, key=lemma2id.get), prefix + ".lemmas")
+    save_vocab(list(all_patterns.keys()), prefix + ".concepts")
+    for name in TRIE_ARRAYS:  # outputs last: its presence marks a complete trie
+        np.save(trie_file(prefix, name), arrays[name])
+    print("lemma trie: %d patterns, %d lemmas, %d nodes" % (len(all_patterns), len(lemma2id), len(children)))
+
+
+class LemmaTrieMatcher(object):
+    """
+    Drop-in for the spaCy Matcher of grounding_concepts.load_matcher. `matcher(doc)` returns the same
+    (concept, start, end) matches as the Matcher (with the concept string instead of its hash), in the same
+    order; `match_lemmas` does the same on a list of lemma strings, without spaCy.
+    """
+
+    def __init__(self, prefix, mmap_mode="r"):
+        self.prefix = prefix
+        self.lemmas = Vocab(prefix + ".lemmas", mmap_mode)
+        self.concepts = Vocab(prefix + ".concepts", mmap_mode)
+        for name in TRIE_ARRAYS:
+            setattr(self, name, np.load(trie_file(prefix, name), mmap_mode=mmap_mode))
+        self.lemma2id = {w: i for i, w in enumerate(self.lemmas)}
+        # memoryviews: plain ints on indexing, and bisect works on them directly
+        self._child_offsets = memoryview(self.child_offsets)
+        self._child_lemmas = memoryview(self.child_lemmas)
+        self._child_nodes = memoryview(self.child_nodes)
+        self._output_offsets = memoryview(self.output_offsets)
+        self._outputs = memoryview(self.outputs)
+
+    def __len__(self):
+        return len(self.concepts)
+
+    def child(self, node, lemma_id):
+        lo, hi = self._child_offsets[node], self._child_offsets[node + 1]
+        i = bisect_left(self._child_lemmas, lemma_id, lo, hi)
+        return self._child_nodes[i] if i < hi and self._child_lemmas[i] == lemma_id else -1
+
+    def match_lemma_ids(self, lemma_ids):
+        """
+        :return: (concept id, start, end) of every pattern occurrence, ordered by end, then start, then pattern
+        order, like spaCy's Matcher.
+        """
+        matches = []
+        for start in range(len(lemma_ids)):
+            node = 0
+            for end in range(start, len(lemma_ids)):
+                if lemma_ids[end] < 0:
+                    break
+                node = self.child(node, lemma_ids[end])
+                if node < 0:
+                    break
+                for k in range(self._output_offsets[node], self._output_offsets[node + 1]):
+                    matches.append((self._outputs[k], start, end + 1))
+        matches.sort(key=lambda m: (m[2], m[1]))  # stable: pattern order within a span
+        return matches
+
+    def match_lemmas(self, lemmas):
+        lemma2id = self.lemma2id
+        return [(self.concepts[k], start, end) for k, start, end in
+                self.match_lemma_ids([lemma2id.get(l, -1) for l in lemmas])]
+
+    def __call__(self, doc):
+        return self.match_lemmas([token.lemma_ for token in doc])
+
+
+def load_lemma_trie(prefix):
+    print("loading lemma trie from %s" % prefix)
+    return LemmaTrieMatcher(prefix)
+
+
+# python lemma_matcher.py
+if __name__ == "__main__":
+    config = configparser.ConfigParser()
+    config.read("paths.cfg")
+    with open(config["paths"]["matcher_patterns"], "r", encoding="utf8") as f:
+        build_lemma_trie(json.load(f), config["paths"]["matcher_trie"])
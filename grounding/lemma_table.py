@@ -0,0 +1,116 @@
+"""
+spaCy-free tokenizer and lemmatizer for grounding, driven by a precomputed word -> lemma table.
+
+Grounding only needs the lowercased tokens of a sentence, their lemmas (for the lemma trie of lemma_matcher.py)
+and the text of matched spans. `LemmaTableNLP` provides exactly that with a regex tokenizer and a dict lookup,
+so `grounding_concepts.ground_mentioned_concepts` / `hard_ground` run unchanged on its docs. The table is built
+once by running spaCy over the statement files and keeping the most frequent lemma of every word; words
+missing from it are their own lemma. Lemmas that spaCy assigns by context (the same word tagged differently)
+and tokenization corner cases can differ, see check_grounding_parity.py.
+"""
+
+import re
+import sys
+import json
+import configparser
+from collections import Counter, defaultdict
+
+from tqdm import tqdm
+
+
+# "don't" -> "do", "n't" and "it's" -> "it", "'s" like spaCy, then words, then any other single character
+TOKEN_RE = re.compile(r"\w+(?=n't\b)|n't\b|'(?:s|m|d|ll|re|ve)\b|\w+|[^\w\s]")
+
+
+class TableToken(object):
+    __slots__ = ["text", "lemma_", "whitespace_"]
+
+    def __init__(self, text, lemma, whitespace):
+        self.text = text
+        self.lemma_ = lemma
+        self.whitespace_ = whitespace
+
+
+class TableDoc(object):
+    """
+    The parts of a spaCy Doc that grounding uses: iteration over tokens, len, and `doc[start:end].text`.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return TableDoc(self.tokens[i])
+        return self.tokens[i]
+
+    @property
+    def text(self):
+        # like spaCy's Span.text: the tokens with their whitespace, except after the last one
+        if len(self.tokens) == 0:
+            return ""
+        return "".join(t.text + t.whitespace_ for t in self.tokens[:-1]) + self.tokens[-1].text
+
+
+def tokenize(text):
+    """
+    :return: list of (token text, whitespace after it).
+    """
+    matches = list(TOKEN_RE.finditer(text))
+    return [(m.group(), text[m.end():matches[k + 1].start()] if k + 1 < len(matches) else text[m.end():])
+            for k, m in enumerate(matches)]
+
+
+class LemmaTableNLP(object):
+    """
+    Stand-in for the spaCy pipeline of grounding: `nlp(text)` and `nlp.pipe(texts)` give TableDocs.
+    """
+
+    def __init__(self, word_lemmas):
+        self.word_lemmas = word_lemmas
+
+    def __call__(self, text):
+        word_lemmas = self.word_lemmas
+        return TableDoc([TableToken(t, word_lemmas.get(t, t), ws) for t, ws in tokenize(text)])
+
+    def pipe(self, texts, batch_size=None, n_process=1):
+        for text in texts:
+            yield self(text)
+
+
+def build_word_lemmas(nlp, texts, batch_size=1000, n_process=1):
+    """
+    The most frequent spaCy lemma of every token text.
+    """
+    counts = defaultdict(Counter)
+    for doc in tqdm(nlp.pipe(texts, batch_size=batch_size, n_process=n_process), desc="lemmatizing"):
+        for token in doc:
+            counts[token.text][token.lemma_] += 1
+    return {word: lemmas.most_common(1)[0][0] for word, lemmas in counts.items()}
+
+
+def load_word_lemmas(path):
+    print("loading word lemmas from %s" % path)
+    with open(path, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+# python lemma_table.py ../datasets/csqa_new/train_rand_split.jsonl.statements ../datasets/csqa_new/dev_rand_split.jsonl.statements
+if __name__ == "__main__":
+    from grounding_concepts import load_nlp, read_statements
+    config = configparser.ConfigParser()
+    config.read("paths.cfg")
+    texts = []
+    for filename in sys.argv[1:]:
+        sents, answers = read_statements(filename)
+        texts += [t.lower() for t in sents + answers]  # grounding lowercases everything it parses
+    word_lemmas = build_word_lemmas(load_nlp(), texts)
+    print("%d words" % len(word_lemmas))
+    with open(config["paths"]["word_lemmas"], "w", encoding="utf8") as f:
+        json.dump(word_lemmas, f)
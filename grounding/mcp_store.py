@@ -0,0 +1,185 @@
+"""
+Packed, memory-mappable storage for grounded concepts (.mcp).
+
+The legacy .mcp is a JSON list with one {"sent", "ans", "qc", "ac"} dict per statement, where qc / ac are lists
+of concept strings. A packed store keeps the same data in flat arrays next to it, e.g. for
+"train_rand_split.jsonl.statements.mcp":
+
+    path.qc.npy            int32  concept ids of the question concepts, statement after statement
+    path.qc_offsets.npy    int64  [num_statements + 1]      question concepts of statement i are qc[qc_offsets[i]:..]
+    path.ac.npy            int32  concept ids of the answer concepts
+    path.ac_offsets.npy    int64  [num_statements + 1]
+    path.text.npy          uint8  utf8 bytes of all statements and answers: sent 0, ans 0, sent 1, ans 1, ...
+    path.text_offsets.npy  int64  [2 * num_statements + 1]
+
+`load_mcp(path, concept_vocab)` opens the store if there is one (and it is not older than a JSON file at `path`),
+else the JSON file. Both can be indexed and iterated statement by statement in the legacy layout.
+"""
+
+import os
+import sys
+import json
+import configparser
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+
+
+MCP_ARRAYS = ["qc", "qc_offsets", "ac", "ac_offsets", "text", "text_offsets"]
+
+
+def mcp_file(path, name):
+    return "%s.%s.npy" % (path, name)
+
+
+def is_mcp_store(path):
+    if not os.path.exists(mcp_file(path, "text_offsets")):
+        return False
+    # a JSON file written after the store (e.g. by an older script) wins
+    return not os.path.exists(path) or os.path.getmtime(path) <= os.path.getmtime(mcp_file(path, "text_offsets"))
+
+
+def load_mcp(path, concept_vocab=None):
+    """
+    :param concept_vocab: the shared concept Vocab (embeddings/vocab.py), needed to read a packed store.
+    """
+    if is_mcp_store(path):
+        print("loading packed grounding from %s" % path)
+        return MCPStore(path, concept_vocab)
+    print("loading grounding from %s" % path)
+    with open(path, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def save_mcp(path, mcp_data, concept_vocab, max_warnings=20):
+    """
+    Packs statements in the legacy layout into a store at `path`. The store only holds concept ids, so this is
+    lossy: concepts missing from the vocab are dropped, with a warning for each statement that loses some
+    (every later stage only keeps concepts of the vocab anyway, but the JSON written before kept them).
+    :param max_warnings: number of statements listed individually before the warnings are only counted.
+    """
+    qc, qc_offsets, ac, ac_offsets = [], [0], [], [0]
+    texts = []
+    num_unknown, num_lossy = 0, 0
+    for i, item in enumerate(tqdm(mcp_data, desc="packing %s" % path)):
+        unknown = []
+        for concepts, ids, offsets in [(item["qc"], qc, qc_offsets), (item["ac"], ac, ac_offsets)]:
+            concept_ids = concept_vocab.ids(concepts).tolist()
+            unknown += [c for c, c_id in zip(concepts, concept_ids) if c_id < 0]
+            ids.extend(c for c in concept_ids if c >= 0)
+            offsets.append(len(ids))
+        texts.append(item["sent"].encode("utf8"))
+        texts.append(item["ans"].encode("utf8"))
+        if len(unknown) > 0:
+            num_unknown += len(unknown)
+            num_lossy += 1
+            if num_lossy <= max_warnings:
+                print("warning: statement %d (%r): dropped concepts missing from the vocab: %s"
+                      % (i, item["sent"], ", ".join(unknown)))
+    if num_unknown > 0:
+        print("warning: dropped %d concepts missing from the vocab in %d / %d statements"
+              % (num_unknown, num_lossy, len(mcp_data)))
+
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in texts], out=text_offsets[1:])
+    arrays = {"qc": np.array(qc, dtype=np.int32), "qc_offsets": np.array(qc_offsets, dtype=np.int64),
+              "ac": np.array(ac, dtype=np.int32), "ac_offsets": np.array(ac_offsets, dtype=np.int64),
+              "text": np.frombuffer(b"".join(texts), dtype=np.uint8), "text_offsets": text_offsets}
+    # text_offsets last: its presence marks a complete store; write-then-rename so a store that is being read
+    # (prune_qc.py rewrites its input) is never truncated under the reader's memory map
+    for name in MCP_ARRAYS:
+        tmp = mcp_file(path, name) + ".tmp.npy"
+        np.save(tmp, arrays[name])
+        os.replace(tmp, mcp_file(path, name))
+
+
+class MCPStore(object):
+    """
+    Read-only, memory-mapped grounding store. `store[i]` rebuilds statement i as a {"sent", "ans", "qc", "ac"}
+    dict on demand; `qc_ids(i)` / `ac_ids(i)` give the concept ids without going through the vocab.
+    """
+
+    def __init__(self, path, concept_vocab=None, mmap_mode="r"):
+        self.path = path
+        self.concept_vocab = concept_vocab
+        for name in MCP_ARRAYS:
+            setattr(self, name, np.load(mcp_file(path, name), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.qc_offsets) - 1
+
+    def qc_ids(self, i):
+        return self.qc[self.qc_offsets[i]:self.qc_offsets[i + 1]]
+
+    def ac_ids(self, i):
+        return self.ac[self.ac_offsets[i]:self.ac_offsets[i + 1]]
+
+    def _text(self, k):
+        return self.text[self.text_offsets[k]:self.text_offsets[k + 1]].tobytes().decode("utf8")
+
+    def statement(self, i):
+        id2concept = self.concept_vocab
+        return {"sent": self._text(2 * i), "ans": self._text(2 * i + 1),
+                "qc": [id2concept[c] for c in self.qc_ids(i).tolist()],
+                "ac": [id2concept[c] for c in self.ac_ids(i).tolist()]}
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.statement(k) for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.statement(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.statement(i)
+
+
+def statement_concept_ids(mcp_data, i, concept2id):
+    """
+    (question concept ids, answer concept ids) of statement i, read straight from the arrays of a store.
+    """
+    if isinstance(mcp_data, MCPStore):
+        return mcp_data.qc_ids(i).tolist(), mcp_data.ac_ids(i).tolist()
+    return [concept2id[c] for c in mcp_data[i]["qc"]], [concept2id[c] for c in mcp_data[i]["ac"]]
+
+
+def shard(mcp_data, batch_id, num_batches=100):
+    """
+    The statements of shard `batch_id`, split like np.array_split(mcp_data, num_batches)[batch_id].
+    """
+    size, extra = divmod(len(mcp_data), num_batches)
+    start = batch_id * size + min(batch_id, extra)
+    return mcp_data[start:start + size + (1 if batch_id < extra else 0)]
+
+
+def export_json(path, output_path, concept_vocab):
+    """
+    Plain JSON copy of a store, for debugging.
+    """
+    store = MCPStore(path, concept_vocab)
+    with open(output_path, "w", encoding="utf8") as fo:
+        json.dump(list(tqdm(store, total=len(store), desc="unpacking %s" % path)), fo, indent=2)
+
+
+def load_concept_vocab():
+    config = configparser.ConfigParser()
+    config.read("paths.cfg")
+    return load_vocab(config["paths"]["concept_vocab"])
+
+
+if __name__ == "__main__":
+    cmd, path = sys.argv[1], sys.argv[2]
+    concept_vocab = load_concept_vocab()
+    if cmd == "from_json":
+        with open(path, "r", encoding="utf8") as f:
+            save_mcp(path, json.load(f), concept_vocab)
+    elif cmd == "to_json":
+        export_json(path, sys.argv[3] if len(sys.argv) > 3 else path + ".json", concept_vocab)
+
+
+# python mcp_store.py from_json ../datasets/csqa_new/train_rand_split.jsonl.statements.mcp
+# python mcp_store.py to_json ../datasets/csqa_new/train_rand_split.jsonl.statements.mcp
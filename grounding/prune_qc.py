@@ -1,70 +1,97 @@
+"""
+Pruning of grounded concepts: drops question concepts containing a stopword, answer concepts made only of
+stopwords, concepts outside the vocab, and "xer" / "xe" when "x" was grounded too.
+
+The stopword tests only depend on the concept, so they are precomputed once per vocab as flags stored next to
+it (concept.txt.stop_flags.npy, uint8 per concept id: HAS_STOP | ALL_STOP). grounding_concepts.py applies
+`prune_concepts` to every statement as it is grounded; running this script is only needed for .mcp files
+grounded before that.
+"""
+
 from tqdm import tqdm
-import nltk
-import json
-# print('NLTK Version: %s' % (nltk.__version__))
-nltk.download('stopwords')
-nltk_stopwords = nltk.corpus.stopwords.words('english')
-nltk_stopwords += ["like", "gone", "did", "going", "would", "could", "get", "in", "up", "may", "wanter"]
-print(nltk_stopwords)
-# print(nltk_stopwords)
+import numpy as np
 import configparser
 import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+from mcp_store import load_mcp, save_mcp
+
+
+HAS_STOP = 1
+ALL_STOP = 2
+
+EXTRA_STOPWORDS = ["like", "gone", "did", "going", "would", "could", "get", "in", "up", "may", "wanter"]
+
+
+def load_stopwords():
+    import nltk
+    # print('NLTK Version: %s' % (nltk.__version__))
+    nltk.download('stopwords')
+    nltk_stopwords = nltk.corpus.stopwords.words('english')
+    nltk_stopwords += EXTRA_STOPWORDS
+    return set(nltk_stopwords)
+
+
+def stop_flags_file(vocab_path):
+    return vocab_path + ".stop_flags.npy"
+
+
+def build_stop_flags(concept_vocab, stopwords):
+    flags = np.zeros(len(concept_vocab), dtype=np.uint8)
+    for i, c in enumerate(tqdm(concept_vocab, total=len(concept_vocab), desc="stopword flags")):
+        is_stop = [t in stopwords for t in c.split("_")]
+        flags[i] = (HAS_STOP if any(is_stop) else 0) | (ALL_STOP if all(is_stop) else 0)
+    return flags
+
+
+def load_stop_flags(vocab_path, concept_vocab=None):
+    """
+    The stopword flags of every concept of the vocab file `vocab_path`, (re)built if missing or older than it.
+    """
+    path = stop_flags_file(vocab_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(vocab_path):
+        print("building stopword flags for %s" % vocab_path)
+        flags = build_stop_flags(concept_vocab if concept_vocab is not None else load_vocab(vocab_path),
+                                 load_stopwords())
+        # batched_grounding starts all batches at once, several of them may build the flags
+        tmp = "%s.%d.tmp.npy" % (path, os.getpid())
+        np.save(tmp, flags)
+        os.replace(tmp, path)
+    return np.load(path, mmap_mode="r")
+
+
+def prune_concepts(concepts, concept2id, stop_flags, is_answer):
+    """
+    :param concepts: grounded concepts of one statement (qc or ac), in order.
+    :param concept2id: concept -> id, anything supporting `get` (a dict, or Vocab.word2id).
+    :param is_answer: answer concepts are dropped only if all their words are stopwords.
+    """
+    concept_set = set(concepts)
+    ids = np.array([concept2id.get(c, -1) for c in concepts], dtype=np.int64)
+    keep = ids >= 0
+    keep[keep] = (stop_flags[ids[keep]] & (ALL_STOP if is_answer else HAS_STOP)) == 0
+    return [c for c, k in zip(concepts, keep.tolist()) if k and
+            not (c[-2:] == "er" and c[:-2] in concept_set) and not (c[-1:] == "e" and c[:-1] in concept_set)]
 
-data = []
 
+def prune_item(item, concept2id, stop_flags):
+    item["qc"] = prune_concepts(item["qc"], concept2id, stop_flags, is_answer=False)
+    item["ac"] = prune_concepts(item["ac"], concept2id, stop_flags, is_answer=True)
+    return item
 
 
-concept_vocab = set()
-config = configparser.ConfigParser()
-config.read("paths.cfg")
-with open(config["paths"]["concept_vocab"], "r", encoding="utf8") as f:
-    cpnet_vocab = set([l.strip() for l in list(f.readlines())])
+def prune_file(path):
+    config = configparser.ConfigParser()
+    config.read("paths.cfg")
+    cpnet_vocab = load_vocab(config["paths"]["concept_vocab"])
+    stop_flags = load_stop_flags(config["paths"]["concept_vocab"], cpnet_vocab)
+    concept2id = cpnet_vocab.word2id
+    data = load_mcp(path, cpnet_vocab)
+    prune_data = [prune_item(item, concept2id, stop_flags) for item in tqdm(data)]
+    save_mcp(path, prune_data, cpnet_vocab)
 
-# cpnet_vocab = [c.replace("_", " ") for c in cpnet_vocab]
 
 # python prune_qc.py ../datasets/csqa_new/dev_rand_split.jsonl.statements.mcp
-with open(sys.argv[1], 'r') as f:
-    data = json.load(f)
-
-prune_data = []
-for item in tqdm(data):
-    qc = item["qc"]
-    prune_qc = []
-    for c in qc:
-        if c[-2:] == "er" and c[:-2] in qc:
-            continue
-        if c[-1:] == "e" and c[:-1] in qc:
-            continue
-        have_stop = False
-        for t in c.split("_"):
-            if t in nltk_stopwords:
-                have_stop = True
-        if not have_stop and c in cpnet_vocab:
-            prune_qc.append(c)
-
-    ac = item["ac"]
-    prune_ac = []
-    for c in ac:
-        if c[-2:] == "er" and c[:-2] in ac:
-            continue
-        if c[-1:] == "e" and c[:-1] in ac:
-            continue
-        all_stop = True
-        for t in c.split("_"):
-            if t not in nltk_stopwords:
-                all_stop = False
-        if not all_stop and c in cpnet_vocab:
-            prune_ac.append(c)
-
-    item["qc"] = prune_qc
-    item["ac"] = prune_ac
-
-    prune_data.append(item)
-
-import jsbeautifier
-opts = jsbeautifier.default_options()
-opts.indent_size = 2
-
-with open(sys.argv[1], 'w') as fp:
-    # json.dump(prune_data, f)
-    fp.write(jsbeautifier.beautify(json.dumps(prune_data), opts))
\ No newline at end of file
+if __name__ == "__main__":
+    prune_file(sys.argv[1])
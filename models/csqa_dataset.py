@@ -9,6 +9,9 @@ import os
 import dgl
 import networkx as nx
 import random
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pathfinder.pf_store import load_pf
 
 def load_embeddings(path):
     print("Loading glove concept embeddings with pooling:", path)
@@ -18,7 +21,7 @@ def load_embeddings(path):
 
 class data_with_paths(data.Dataset):
 
-    def __init__(self, statement_json_file, pf_json_file, pretrained_sent_vecs, num_choice=5, max_path_len=5, start=0, end=None, cut_off=3):
+    def __init__(self, statement_json_file, pf_json_file, pretrained_sent_vecs, num_choice=5, max_path_len=5, start=0, end=None, cut_off=3, pf_threshold=None):
         self.qids = []
         self.statements = []
         self.correct_labels = []
@@ -59,9 +62,7 @@ class data_with_paths(data.Dataset):
 
 
         start_time = timeit.default_timer()
-        print("loading paths from %s" % pf_json_file)
-        with open(pf_json_file, 'rb') as handle:
-            pf_json_data = pickle.load(handle)
+        pf_json_data = load_pf(pf_json_file, threshold=pf_threshold)  # pruned on the fly if a threshold is given
         print('\t Done! Time: ', "{0:.2f} sec".format(float(timeit.default_timer() - start_time)))
 
         assert len(statement_json_data) * num_choice == len(pf_json_data)
@@ -69,6 +70,7 @@ class data_with_paths(data.Dataset):
             paths = []
             rels = []
             qa_pairs = list()
+            seen_qa_pairs = set()  # (q, a) tuples, for O(1) membership; qa_pairs keeps the order
             for qas in s:
                 # (q,a) can be identified by the first and last node in every path
                 # qc = qas["qc"]
@@ -80,7 +82,8 @@ class data_with_paths(data.Dataset):
                         q = p[0] + 1
                         a = p[-1] + 1
                         new_qa_pair = False
-                        if (q,a) not in qa_pairs:
+                        if (q,a) not in seen_qa_pairs:
+                            seen_qa_pairs.add((q,a))
                             qa_pairs.append((q,a))
                             new_qa_pair = True
 
@@ -242,7 +245,7 @@ class data_with_graphs(data.Dataset):
 
 class data_with_graphs_and_paths(data.Dataset):
 
-    def __init__(self, statement_json_file, graph_ngx_file, pf_json_file, pretrained_sent_vecs, num_choice=5, start=0, end=None, reload=True, cut_off=3):
+    def __init__(self, statement_json_file, graph_ngx_file, pf_json_file, pretrained_sent_vecs, num_choice=5, start=0, end=None, reload=True, cut_off=3, pf_threshold=None):
 
 
         self.qids = []
@@ -339,9 +342,7 @@ class data_with_graphs_and_paths(data.Dataset):
         self.rel_path_data = []
 
         start_time = timeit.default_timer()
-        print("loading paths from %s" % pf_json_file)
-        with open(pf_json_file, 'rb') as handle:
-            pf_json_data = pickle.load(handle)
+        pf_json_data = load_pf(pf_json_file, threshold=pf_threshold)
         print('\t Done! Time: ', "{0:.2f} sec".format(float(timeit.default_timer() - start_time)))
 
         assert len(statement_json_data) * num_choice == len(pf_json_data)
@@ -349,6 +350,7 @@ class data_with_graphs_and_paths(data.Dataset):
             paths = []
             rels = []
             qa_pairs = list()
+            seen_qa_pairs = set()
             for qas in s:
                 # (q,a) can be identified by the first and last node in every path
                 # qc = qas["qc"]
@@ -383,7 +385,8 @@ class data_with_graphs_and_paths(data.Dataset):
                         paths.append(p)
                         rels.append(r)
 
-                        if (q, a) not in qa_pairs:
+                        if (q, a) not in seen_qa_pairs:
+                            seen_qa_pairs.add((q, a))
                             qa_pairs.append((q, a))
 
             self.qa_pair_data.append(list(qa_pairs))
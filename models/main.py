@@ -176,16 +176,16 @@ def train_kagnet_main():
 
     train_set = data_with_graphs_and_paths("../datasets/csqa_new/train_rand_split.jsonl.statements",
                       "../datasets/csqa_new/train_rand_split.jsonl.statements.pruned.0.15.pnxg",
-                      "../datasets/csqa_new/train_rand_split.jsonl.statements.mcp.pf.cls.pruned.0.15.pickle",
+                      "../datasets/csqa_new/train_rand_split.jsonl.statements.mcp.pf",
                       "../datasets/csqa_new/train_rand_split.jsonl.statements.finetuned.large.-2.npy",
-                      num_choice=5, reload=False, cut_off=3, start=0, end=None)
+                      num_choice=5, reload=False, cut_off=3, start=0, end=None, pf_threshold=0.15)
     
 
     dev_set = data_with_graphs_and_paths("../datasets/csqa_new/dev_rand_split.jsonl.statements",
                       "../datasets/csqa_new/dev_rand_split.jsonl.statements.pruned.0.15.pnxg",
-                      "../datasets/csqa_new/dev_rand_split.jsonl.statements.mcp.pf.cls.pruned.0.15.pickle",
+                      "../datasets/csqa_new/dev_rand_split.jsonl.statements.mcp.pf",
                       "../datasets/csqa_new/dev_rand_split.jsonl.statements.finetuned.large.-2.npy",
-                      num_choice=5, reload=False, cut_off=3, start=0, end=None)
+                      num_choice=5, reload=False, cut_off=3, start=0, end=None, pf_threshold=0.15)
 
 
     print("len(train_set):", len(train_set), "len(dev_set):", len(dev_set))
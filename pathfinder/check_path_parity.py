@@ -0,0 +1,87 @@
+"""
+Parity check of path_enumerator.enumerate_paths against the old networkx search of pathfinder.find_paths, on a
+random graph whose triples are added in random (unsorted) order, like ConceptNet's. Pairs with more paths than
+the cap only agree if the CSR graph keeps the adjacency order of the old nx.Graph.
+"""
+
+import os
+import sys
+import random
+import tempfile
+
+import networkx as nx
+import numpy as np
+from tqdm import tqdm
+
+from cpnet_graph import CPNetGraph, save_cpnet_csr
+from path_enumerator import enumerate_paths
+
+
+def old_cpnet_simple(src, dst):
+    # graph_construction.save_cpnet and pathfinder.load_cpnet before the CSR graph
+    cpnet = nx.MultiDiGraph()
+    for u, v in zip(src, dst):
+        cpnet.add_edge(u, v)
+    cpnet_simple = nx.Graph()
+    for u, v, data in cpnet.edges(data=True):
+        if not cpnet_simple.has_edge(u, v):
+            cpnet_simple.add_edge(u, v)
+    return cpnet_simple
+
+
+def old_find_paths(cpnet_simple, s, t, max_len=4, max_paths=100):
+    all_path = []
+    all_path_set = set()
+    for cutoff in range(1, max_len + 1):
+        for p in nx.all_simple_paths(cpnet_simple, source=s, target=t, cutoff=cutoff):
+            path_str = "-".join([str(c) for c in p])
+            if path_str not in all_path_set:
+                all_path_set.add(path_str)
+                all_path.append(p)
+            if len(all_path) >= max_paths:
+                break
+        if len(all_path) >= max_paths:
+            break
+    all_path.sort(key=len, reverse=False)
+    return all_path
+
+
+def check(num_nodes=300, num_triples=1500, num_pairs=500, seed=0):
+    rng = random.Random(seed)
+    # heavy-tailed degrees, so that many pairs hit the 100-path cap
+    popularity = [1.0 / (k + 1) for k in range(num_nodes)]
+    nodes = list(range(num_nodes))
+    rng.shuffle(nodes)
+    triples = []
+    while len(triples) < num_triples:
+        s, t = rng.choices(nodes, weights=popularity, k=2)
+        if s != t:
+            triples.append((s, t))
+    src = [x for s, t in triples for x in (s, t)]  # every triple in both directions, like save_cpnet
+    dst = [x for s, t in triples for x in (t, s)]
+
+    cpnet_simple = old_cpnet_simple(src, dst)
+    with tempfile.TemporaryDirectory() as tmp:
+        prefix = os.path.join(tmp, "cpnet.csr")
+        save_cpnet_csr(prefix, num_nodes, src, dst, np.zeros(len(src)), np.ones(len(src)))
+        graph = CPNetGraph(prefix, mmap_mode=None)
+
+        in_graph = [u for u in range(num_nodes) if u in cpnet_simple]
+        num_diff = num_capped = 0
+        for _ in tqdm(range(num_pairs), desc="comparing paths"):
+            s, t = rng.sample(in_graph, 2)
+            old = old_find_paths(cpnet_simple, s, t)
+            new = enumerate_paths(graph, s, t, max_len=4, max_paths=100)
+            num_capped += len(old) >= 100
+            if old != new:
+                num_diff += 1
+                if num_diff <= 5:
+                    print("pair (%d, %d): %d old paths, %d new paths, same set: %s" % (
+                        s, t, len(old), len(new), sorted(map(tuple, old)) == sorted(map(tuple, new))))
+    print("%d / %d pairs differ (%d pairs hit the path cap)" % (num_diff, num_pairs, num_capped))
+    return num_diff
+
+
+# python check_path_parity.py [num_pairs]
+if __name__ == "__main__":
+    sys.exit(1 if check(num_pairs=int(sys.argv[1]) if len(sys.argv) > 1 else 500) > 0 else 0)
@@ -0,0 +1,277 @@
+"""
+Compact on-disk ConceptNet graph (CSR).
+
+A graph saved under the prefix `cpnet.csr` is a set of .npy files:
+    cpnet.csr.indptr.npy    int64  [num_nodes + 1]  row offsets
+    cpnet.csr.indices.npy   int32  [num_edges]      target concept id of each directed edge
+    cpnet.csr.rel.npy       int8   [num_edges]      relation id of each edge (inverse relations are >= 17)
+    cpnet.csr.weight.npy    float32[num_edges]      edge weight
+    cpnet.csr.score.npy     float32[num_edges]      optional TransE plausibility of each edge (edge_scoring.py)
+
+and the merged simple graph (one edge per connected pair and direction, weights of all parallel edges of
+both directions summed, like the old nx.Graph `cpnet_simple`):
+    cpnet.csr.simple_indptr.npy   int64  [num_nodes + 1]
+    cpnet.csr.simple_indices.npy  int32  [num_simple_edges]      sorted within a row, for edge lookups
+    cpnet.csr.simple_weight.npy   float32[num_simple_edges]
+    cpnet.csr.simple_order.npy    int32  [num_simple_edges]      row u in adjacency order of the old nx.Graph is
+                                                                 simple_indices[simple_order[indptr[u]:indptr[u+1]]]
+
+The old `cpnet_simple` was filled by iterating the networkx MultiDiGraph (nodes in order of first appearance,
+successors in order of their first edge), so its neighbor order, which decides which paths
+`nx.all_simple_paths` finds first, is not the sorted order. `simple_order` keeps it, and `neighbors` returns
+that order, so the path search gives the same paths as the old one when it stops at the path cap.
+
+Edges are sorted by (source, target); parallel edges between the same two concepts keep the order in which
+they were added, so `relations` returns exactly what `get_edge` returned on the networkx MultiDiGraph.
+"""
+
+import os
+
+import numpy as np
+
+
+CSR_ARRAYS = ["indptr", "indices", "rel", "weight"]
+SIMPLE_ARRAYS = ["simple_indptr", "simple_indices", "simple_weight", "simple_order"]
+
+
+def csr_file(prefix, name):
+    return "%s.%s.npy" % (prefix, name)
+
+
+def save_cpnet_csr(prefix, num_nodes, src, dst, rel, weight):
+    """
+    Saves a directed multigraph given as parallel edge arrays into CSR .npy files.
+    :param prefix: output prefix, e.g. "../conceptnet/cpnet.csr".
+    :param num_nodes: number of concepts (size of the concept vocab).
+    :param src, dst, rel, weight: one entry per directed edge, in insertion order.
+    """
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    num_edges = len(src)
+    # rank of every node in the node order of a networkx graph built by adding these edges one by one
+    node_rank = np.zeros(num_nodes, dtype=np.int64)
+    if num_edges > 0:
+        seen, first = np.unique(np.stack([src, dst], axis=1).ravel(), return_index=True)
+        node_rank[seen[np.argsort(first, kind="stable")]] = np.arange(len(seen))
+    order = np.lexsort((dst, src))  # lexsort is stable: parallel edges keep insertion order
+    src, dst = src[order], dst[order]
+    weight = np.asarray(weight, dtype=np.float64)[order]
+
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+
+    np.save(csr_file(prefix, "indptr"), indptr)
+    np.save(csr_file(prefix, "indices"), dst.astype(np.int32))
+    np.save(csr_file(prefix, "rel"), np.asarray(rel, dtype=np.int8)[order])
+    np.save(csr_file(prefix, "weight"), weight.astype(np.float32))
+
+    # simple graph: group the sorted edges by (src, dst) and sum their weights, then add the sum of the
+    # reverse pair (dst, src), since the undirected graph merges both directions into one edge
+    keys = src * num_nodes + dst
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if len(keys) > 0 else keys
+    pair_keys = keys[starts]
+    pair_weight = np.add.reduceat(weight, starts) if len(starts) > 0 else weight
+    rev_keys = dst[starts] * num_nodes + src[starts]
+    rev = np.minimum(np.searchsorted(pair_keys, rev_keys), max(len(pair_keys) - 1, 0))
+    has_rev = pair_keys[rev] == rev_keys if len(pair_keys) > 0 else rev.astype(bool)
+    has_rev &= rev_keys != pair_keys  # a loop is its own reverse
+    simple_weight = pair_weight + np.where(has_rev, pair_weight[rev], 0.0)
+    simple_indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src[starts], minlength=num_nodes), out=simple_indptr[1:])
+
+    # adjacency order of the old nx.Graph: the pair {u, v} was added when the MultiDiGraph edge iteration
+    # (nodes by rank, successors by first edge) first met u -> v or v -> u
+    pair_pos = node_rank[src[starts]] * max(num_edges, 1) + order[starts]  # order[starts]: first edge of a pair
+    simple_pos = np.where(has_rev, np.minimum(pair_pos, pair_pos[rev]), pair_pos)
+    simple_order = np.lexsort((simple_pos, src[starts]))  # rows stay in place, insertion order inside a row
+
+    np.save(csr_file(prefix, "simple_indptr"), simple_indptr)
+    np.save(csr_file(prefix, "simple_indices"), dst[starts].astype(np.int32))
+    np.save(csr_file(prefix, "simple_weight"), simple_weight.astype(np.float32))
+    np.save(csr_file(prefix, "simple_order"), simple_order.astype(np.int32))
+
+
+def expand_csr(indptr, indices, nodes, score=None, min_score=None):
+    """
+    Sorted unique neighbors of a set of nodes, gathered in one vectorized pass over the CSR rows.
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    starts = indptr[nodes]
+    lens = indptr[nodes + 1] - starts
+    total = int(lens.sum())
+    if total == 0:
+        return np.zeros(0, dtype=indices.dtype)
+    offsets = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(total)
+    if min_score is not None:
+        offsets = offsets[score[offsets] >= min_score]
+    return np.unique(indices[offsets])
+
+
+class CPNetSimpleGraph(object):
+    """
+    Read-only view over the merged simple graph saved with a CSR ConceptNet graph, the replacement of the
+    nx.Graph `cpnet_simple` that every stage used to rebuild from the multigraph.
+    """
+
+    def __init__(self, prefix, mmap_mode="r"):
+        self.prefix = prefix
+        self.indptr = np.load(csr_file(prefix, "simple_indptr"), mmap_mode=mmap_mode)
+        self.indices = np.load(csr_file(prefix, "simple_indices"), mmap_mode=mmap_mode)
+        self.weight = np.load(csr_file(prefix, "simple_weight"), mmap_mode=mmap_mode)
+        if os.path.exists(csr_file(prefix, "simple_order")):
+            self.order = np.load(csr_file(prefix, "simple_order"), mmap_mode=mmap_mode)
+        else:
+            print("%s has no simple_order, neighbors come in id order (rebuild it with graph_construction.py)" % prefix)
+            self.order = None
+        self.num_nodes = len(self.indptr) - 1
+        self.num_edges = len(self.indices)
+
+    def __contains__(self, u):
+        return 0 <= u < self.num_nodes and self.indptr[u + 1] > self.indptr[u]
+
+    def degree(self, u):
+        return int(self.indptr[u + 1] - self.indptr[u])
+
+    def _edge_index(self, u, v):
+        start, end = int(self.indptr[u]), int(self.indptr[u + 1])
+        i = start + int(np.searchsorted(self.indices[start:end], v))
+        return i if i < end and self.indices[i] == v else -1
+
+    def neighbor_order(self, u):
+        """
+        Positions (within row u) of the neighbors of u in adjacency order of the old nx.Graph.
+        """
+        start, end = self.indptr[u], self.indptr[u + 1]
+        if self.order is None:
+            return np.arange(end - start)
+        return np.asarray(self.order[start:end]) - start
+
+    def neighbors(self, u):
+        """
+        Neighbors of u in adjacency order of the old nx.Graph (see simple_order).
+        """
+        row = np.asarray(self.indices[self.indptr[u]:self.indptr[u + 1]])
+        if self.order is None:
+            return row
+        return row[self.neighbor_order(u)]
+
+    def expand(self, nodes):
+        return expand_csr(self.indptr, self.indices, nodes)
+
+    def has_edge(self, u, v):
+        return self._edge_index(u, v) >= 0
+
+    def edge_weight(self, u, v):
+        """
+        Summed weight of all edges between u and v (cpnet_simple[u][v]["weight"] of the old nx.Graph).
+        """
+        return float(self.weight[self._edge_index(u, v)])
+
+
+class CPNetGraph(object):
+    """
+    Read-only view over a CSR ConceptNet graph. The arrays are memory-mapped, so loading is instant and
+    forked worker processes share the same pages.
+    """
+
+    def __init__(self, prefix, mmap_mode="r"):
+        self.prefix = prefix
+        self.indptr = np.load(csr_file(prefix, "indptr"), mmap_mode=mmap_mode)
+        self.indices = np.load(csr_file(prefix, "indices"), mmap_mode=mmap_mode)
+        self.rel = np.load(csr_file(prefix, "rel"), mmap_mode=mmap_mode)
+        self.weight = np.load(csr_file(prefix, "weight"), mmap_mode=mmap_mode)
+        if os.path.exists(csr_file(prefix, "score")):
+            self.score = np.load(csr_file(prefix, "score"), mmap_mode=mmap_mode)
+        else:
+            self.score = None
+        if os.path.exists(csr_file(prefix, "simple_indptr")):
+            self.simple = CPNetSimpleGraph(prefix, mmap_mode)
+        else:
+            self.simple = None  # graph built before the simple arrays were saved
+        self.num_nodes = len(self.indptr) - 1
+        self.num_edges = len(self.indices)
+
+    def __contains__(self, u):
+        return 0 <= u < self.num_nodes and self.indptr[u + 1] > self.indptr[u]
+
+    def degree(self, u):
+        return int(self.indptr[u + 1] - self.indptr[u])
+
+    def _edge_range(self, u, v):
+        start, end = int(self.indptr[u]), int(self.indptr[u + 1])
+        row = self.indices[start:end]
+        lo = int(np.searchsorted(row, v, side="left"))
+        hi = int(np.searchsorted(row, v, side="right"))
+        return start + lo, start + hi
+
+    def neighbors(self, u, min_score=None):
+        """
+        Unique neighbors of u, in adjacency order of the old nx.Graph `cpnet_simple` if the simple graph is saved
+        (sorted otherwise). Every triple is stored in both directions, so these are also the neighbors of u in the
+        undirected simple graph.
+        :param min_score: only keep neighbors whose best edge plausibility (see `hop_score`) reaches it.
+        """
+        if min_score is not None:
+            nbrs, scores = self.neighbor_scores(u)
+            if self.simple is not None:  # same neighbor set as the simple row, sorted the same way
+                perm = self.simple.neighbor_order(u)
+                nbrs, scores = nbrs[perm], scores[perm]
+            return nbrs[scores >= min_score]
+        if self.simple is not None:
+            return self.simple.neighbors(u)
+        row = np.asarray(self.indices[self.indptr[u]:self.indptr[u + 1]])
+        if len(row) == 0:
+            return row
+        keep = np.empty(len(row), dtype=bool)
+        keep[0] = True
+        np.not_equal(row[1:], row[:-1], out=keep[1:])
+        return row[keep]
+
+    def neighbor_scores(self, u):
+        """
+        Sorted unique neighbors of u and the plausibility of the hop to each of them.
+        """
+        start, end = self.indptr[u], self.indptr[u + 1]
+        row = np.asarray(self.indices[start:end])
+        if len(row) == 0:
+            return row, np.zeros(0, dtype=np.float32)
+        keep = np.empty(len(row), dtype=bool)
+        keep[0] = True
+        np.not_equal(row[1:], row[:-1], out=keep[1:])
+        return row[keep], np.maximum.reduceat(np.asarray(self.score[start:end]), np.flatnonzero(keep))
+
+    def expand(self, nodes, min_score=None):
+        """
+        Sorted unique neighbors of a set of nodes, gathered in one vectorized pass over the CSR rows.
+        :param min_score: only follow edges with at least this plausibility.
+        """
+        if min_score is None and self.simple is not None:
+            return self.simple.expand(nodes)
+        return expand_csr(self.indptr, self.indices, nodes, None if min_score is None else self.score, min_score)
+
+    def has_edge(self, u, v, min_score=None):
+        if min_score is None and self.simple is not None:
+            return self.simple.has_edge(u, v)
+        lo, hi = self._edge_range(u, v)
+        if min_score is not None:
+            return hi > lo and self.score[lo:hi].max() >= min_score
+        return hi > lo
+
+    def hop_score(self, u, v):
+        """
+        Plausibility of the hop u -> v: the best score over the parallel edges, which is exactly the hop factor
+        of `path_scoring.score_triples`. Scores are symmetric, hop_score(u, v) == hop_score(v, u).
+        """
+        lo, hi = self._edge_range(u, v)
+        return float(self.score[lo:hi].max())
+
+    def relations(self, u, v):
+        """
+        Distinct relation ids on the edges u -> v (same order as the old `get_edge`).
+        """
+        lo, hi = self._edge_range(u, v)
+        return list(set(self.rel[lo:hi].tolist()))
+
+    def weights(self, u, v):
+        lo, hi = self._edge_range(u, v)
+        return self.weight[lo:hi].tolist()
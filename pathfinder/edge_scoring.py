@@ -0,0 +1,43 @@
+"""
+Offline stage: TransE plausibility of every ConceptNet edge, stored next to the CSR graph as
+cpnet.csr.score.npy (float32, aligned with the graph's edge order).
+
+Each edge is scored like one hop of `path_scoring.score_triples` with a single relation: inverse relations
+(id >= 17) swap head and tail, and antonym / relatedto also count in the other direction. The best score over
+the parallel edges u -> v is therefore the hop factor of any path through u -> v, and since a path score is a
+product of factors <= 1, a hop below a pruning threshold already rules out every path through it.
+"""
+
+import configparser
+
+import numpy as np
+from tqdm import tqdm
+
+import path_scoring
+from cpnet_graph import CPNetGraph, csr_file
+
+
+config = configparser.ConfigParser()
+config.read("paths.cfg")
+
+
+def score_edges(graph, chunk_size=1000000):
+    src = np.repeat(np.arange(graph.num_nodes), np.diff(graph.indptr))
+    scores = np.zeros(graph.num_edges, dtype=np.float32)
+    for lo in tqdm(range(0, graph.num_edges, chunk_size), desc="Scoring edges"):
+        hi = min(lo + chunk_size, graph.num_edges)
+        scores[lo:hi] = path_scoring.score_hops_batch(src[lo:hi], np.asarray(graph.indices[lo:hi]),
+                                                      np.asarray(graph.rel[lo:hi]), np.arange(hi - lo + 1))
+    return scores
+
+
+def save_edge_scores():
+    path_scoring.load_resources(method="triple_cls")
+    graph = CPNetGraph(config["paths"]["conceptnet_en_csr"])
+    scores = score_edges(graph)
+    np.save(csr_file(graph.prefix, "score"), scores)
+    print("saved %d edge scores to %s" % (len(scores), csr_file(graph.prefix, "score")))
+
+
+if __name__ == "__main__":
+    save_edge_scores()
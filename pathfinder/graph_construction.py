@@ -1,5 +1,4 @@
 import configparser
-import networkx as nx
 import itertools
 import math
 import random
@@ -9,7 +8,11 @@ import sys
 import time
 import timeit
 import nltk
-import json
+import os
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+from cpnet_graph import save_cpnet_csr
 # print('NLTK Version: %s' % (nltk.__version__))
 nltk.download('stopwords')
 nltk_stopwords = nltk.corpus.stopwords.words('english')
@@ -23,62 +26,56 @@ concept2id = None
 relation2id = None
 id2relation = None
 id2concept = None
+concept_vocab = None
+relation_vocab = None
 blacklist = set(["uk", "us", "take", "make", "object", "person", "people"])
 
 def load_resources():
-    global concept2id, relation2id, id2relation, id2concept
-    concept2id = {}
-    id2concept = {}
-    with open(config["paths"]["concept_vocab"], "r", encoding="utf8") as f:
-        for w in f.readlines():
-            concept2id[w.strip()] = len(concept2id)
-            id2concept[len(id2concept)] = w.strip()
+    global concept2id, relation2id, id2relation, id2concept, concept_vocab, relation_vocab
+    concept_vocab = load_vocab(config["paths"]["concept_vocab"])
+    concept2id, id2concept = concept_vocab.word2id, concept_vocab.id2word
 
     print("concept2id done")
-    id2relation = {}
-    relation2id = {}
-    with open(config["paths"]["relation_vocab"], "r", encoding="utf8") as f:
-        for w in f.readlines():
-            id2relation[len(id2relation)] = w.strip()
-            relation2id[w.strip()] = len(relation2id)
+    relation_vocab = load_vocab(config["paths"]["relation_vocab"])
+    relation2id, id2relation = relation_vocab.word2id, relation_vocab.id2word
     print("relation2id done")
 
 def save_cpnet():
     global concept2id, relation2id, id2relation, id2concept, blacklist
     load_resources()
-    graph = nx.MultiDiGraph()
-    with open(config["paths"]["conceptnet_en"], "r", encoding="utf8") as f:
-        lines = f.readlines()
 
-        def not_save(cpt):
-            if cpt in blacklist:
+    def not_save(cpt):
+        if cpt in blacklist:
+            return True
+        for t in cpt.split("_"):
+            if t in nltk_stopwords:
                 return True
-            for t in cpt.split("_"):
-                if t in nltk_stopwords:
-                    return True
-            return False
+        return False
+
+    print("reading triples")
+    with open(config["paths"]["conceptnet_en"], "r", encoding="utf8") as f:
+        rels, heads, tails, weights = zip(*(line.strip().split('\t') for line in f))
+    rel = relation_vocab.ids(rels)
+    subj = concept_vocab.ids(heads)
+    obj = concept_vocab.ids(tails)
+    assert (rel >= 0).all() and (subj >= 0).all() and (obj >= 0).all(), "triples outside the vocab"
+    weight = np.array(weights, dtype=np.float64)
+    not_saved = np.array([not_save(c) for c in concept_vocab], dtype=bool)
 
-        for line in tqdm(lines, desc="saving to graph"):
-            ls = line.strip().split('\t')
-            rel = relation2id[ls[0]]
-            subj = concept2id[ls[1]]
-            obj = concept2id[ls[2]]
-            weight = float(ls[3])
-            if id2relation[rel] == "hascontext":
-                continue
-            if not_save(ls[1]) or not_save(ls[2]):
-                continue
-            if id2relation[rel] == "relatedto" or id2relation[rel] == "antonym":
-                weight -= 0.3
-                # continue
-            if subj == obj: # delete loops
-                continue
-            weight = 1+float(math.exp(1-weight))
-            graph.add_edge(subj, obj, rel=rel, weight=weight)
-            graph.add_edge(obj, subj, rel=rel+len(relation2id), weight=weight)
+    # the per-triple filters and weight transform, on all triples at once
+    keep = (rel != relation2id.get("hascontext", -1)) & ~not_saved[subj] & ~not_saved[obj] & (subj != obj)  # delete loops
+    weight[(rel == relation2id.get("relatedto", -1)) | (rel == relation2id.get("antonym", -1))] -= 0.3
+    weight = 1 + np.exp(1 - weight)
+    rel, subj, obj, weight = rel[keep], subj[keep], obj[keep], weight[keep]
 
+    # every triple in both directions, forward and inverse edge next to each other
+    src = np.stack([subj, obj], axis=1).ravel()
+    dst = np.stack([obj, subj], axis=1).ravel()
+    rels = np.stack([rel, rel + len(relation2id)], axis=1).ravel()
+    weights = np.repeat(weight, 2)
 
-    nx.write_gpickle(graph, config["paths"]["conceptnet_en_graph"])
+    save_cpnet_csr(config["paths"]["conceptnet_en_csr"], len(concept2id), src, dst, rels, weights)
+    print("saved %d edges to %s" % (len(src), config["paths"]["conceptnet_en_csr"]))
     # with open(config["paths"]["conceptnet_en_graph"], 'w') as f:
     #     f.write(json.dumps(nx.node_link_data(graph)))
 
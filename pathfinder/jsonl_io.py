@@ -0,0 +1,68 @@
+"""
+Streaming JSON-lines output with checkpoints, so a killed job can resume where it stopped.
+
+Next to `foo.jsonl` the writer keeps `foo.jsonl.idx`, one "<records done>\t<byte offset>" line per checkpoint.
+On restart the output is truncated back to the last checkpoint (dropping a half-written tail) and the caller
+skips the first `num_done` records.
+"""
+
+import json
+import os
+
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def read_checkpoint(path):
+    """
+    :return: (records done, byte offset) of the last complete checkpoint of `path`, or (0, 0).
+    """
+    num_done, offset = 0, 0
+    if os.path.exists(path + ".idx"):
+        with open(path + ".idx", "r") as f:
+            for line in f:
+                ls = line.strip().split("\t")
+                if len(ls) == 2:  # a partly written last line is ignored
+                    num_done, offset = int(ls[0]), int(ls[1])
+    return num_done, offset
+
+
+class ResumableJsonlWriter(object):
+
+    def __init__(self, path, checkpoint_every=100):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.num_done, offset = read_checkpoint(path)
+        if not os.path.exists(path):
+            self.num_done, offset = 0, 0
+        self.fo = open(path, "a+b")
+        self.fo.truncate(offset)
+        self.fo.seek(offset)
+        self.fidx = open(path + ".idx", "w")  # restart the index from the resume point
+        self.checkpoint()
+
+    def write(self, record):
+        self.fo.write((json.dumps(record) + "\n").encode("utf8"))
+        self.num_done += 1
+        if self.num_done % self.checkpoint_every == 0:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.fo.flush()
+        os.fsync(self.fo.fileno())
+        self.fidx.write("%d\t%d\n" % (self.num_done, self.fo.tell()))
+        self.fidx.flush()
+
+    def close(self):
+        self.checkpoint()
+        self.fo.close()
+        self.fidx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,110 @@
+"""
+LRU cache of concept neighborhoods for the path search.
+
+Grounded concepts are heavy-tailed ("person", "water", "store" occur in thousands of statements), so the same
+1-hop neighbor lists and backward frontiers (path_enumerator.walk_frontiers) are expanded over and over. The
+cache keeps them under a memory budget (the summed size of the cached arrays). Entries for the most frequent
+concepts of a file can be computed in the parent before the worker pool forks, so every worker starts warm,
+and saved to disk so later runs and the other shards of a split start warm too.
+"""
+
+import os
+import pickle
+from collections import Counter, OrderedDict
+
+from path_enumerator import walk_frontiers, within_frontiers
+from pair_cache import graph_fingerprint
+
+
+class NeighborhoodCache(object):
+    """
+    :param min_score: the hop plausibility threshold of the search (min_hop_score / score_threshold), or None;
+    every entry is expanded with it, so one cache serves one setting.
+    :param max_bytes: memory budget of the cached arrays.
+    """
+
+    def __init__(self, graph, min_score=None, max_bytes=512 << 20):
+        self.graph = graph
+        self.min_score = min_score
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._fingerprint = None
+
+    def signature(self):
+        # the structure, adjacency order and (when filtering on them) edge scores of the graph, like PairCache
+        if self._fingerprint is None:
+            self._fingerprint = graph_fingerprint(self.graph, with_scores=self.min_score is not None)
+        return self._fingerprint, self.min_score
+
+    def _get(self, key, compute):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = compute()
+        size = sum(arr.nbytes for arr in (value if isinstance(value, (list, tuple)) else [value]))
+        self.entries[key] = (value, size)
+        self.num_bytes += size
+        while self.num_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.num_bytes -= evicted_size
+        return value
+
+    def neighbors(self, u):
+        return self._get(("neighbors", u), lambda: self.graph.neighbors(u, self.min_score))
+
+    def neighbor_scores(self, u):
+        return self._get(("neighbor_scores", u), lambda: self.graph.neighbor_scores(u))
+
+    def frontiers(self, target, depth):
+        return self._get(("frontiers", target, depth),
+                         lambda: walk_frontiers(self.graph, target, depth, self.min_score))
+
+    def within_frontiers(self, target, depth):
+        return self._get(("within_frontiers", target, depth),
+                         lambda: within_frontiers(self.frontiers(target, depth)))
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self):
+        return "neighborhood cache: %d entries, %.1f MB, %d hits, %d misses, hit rate %.4f" % (
+            len(self.entries), self.num_bytes / (1 << 20), self.hits, self.misses, self.hit_rate())
+
+    def save(self, path):
+        with open(path, "wb") as fo:
+            pickle.dump({"signature": self.signature(), "entries": list(self.entries.items())}, fo,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path):
+        """
+        Adds the entries saved at `path`, unless they were computed on another graph or threshold.
+        :return: whether anything was loaded.
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as fi:
+            saved = pickle.load(fi)
+        if saved["signature"] != self.signature():
+            print("ignoring neighborhood cache %s: built for another graph, edge scores or threshold" % path)
+            return False
+        for key, (value, size) in saved["entries"]:
+            if key not in self.entries and self.num_bytes + size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.num_bytes += size
+        return True
+
+
+def hot_concepts(mcp_data, top_k):
+    """
+    The `top_k` most frequent question concepts and answer concepts of a grounded (.mcp) file.
+    """
+    qc_counts = Counter(c for item in mcp_data for c in item["qc"])
+    ac_counts = Counter(c for item in mcp_data for c in item["ac"])
+    return [c for c, _ in qc_counts.most_common(top_k)], [c for c, _ in ac_counts.most_common(top_k)]
@@ -0,0 +1,88 @@
+"""
+Persistent cache of path-finding results per (qc, ac) pair.
+
+The same pair comes back across the five choices of a question, across train / dev / test and across reruns,
+so finished results are kept in an SQLite file keyed by the graph fingerprint (a hash of the CSR arrays, so a
+rebuilt graph never serves stale paths), the search settings and the pair. The database runs in WAL mode:
+the pool workers only read, and the parent process writes the results the workers send back.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+
+def graph_fingerprint(graph, with_scores=False):
+    """
+    Hash of the graph structure (and of the edge plausibilities, for searches that use them). The adjacency
+    order decides which paths are kept at the path cap, so it is hashed too.
+    """
+    h = hashlib.sha1()
+    arrays = [graph.indptr, graph.indices, graph.rel] + ([graph.score] if with_scores else [])
+    if graph.simple is not None and graph.simple.order is not None:
+        arrays.append(graph.simple.order)
+    for arr in arrays:
+        h.update(memoryview(np.ascontiguousarray(arr)).cast("B"))
+    return h.hexdigest()
+
+
+class PairCache(object):
+    """
+    :param path: the SQLite file (created if missing).
+    :param fingerprint: `graph_fingerprint` of the graph the results come from.
+    :param mode: the search and its settings, e.g. "enumerate:4:100" (see pathfinder.py).
+    """
+
+    def __init__(self, path, fingerprint, mode):
+        self.path = path
+        self.key = fingerprint + ":" + mode
+        self._conn = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        conn = self.conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS pairs (key TEXT, qc TEXT, ac TEXT, pf_res TEXT, "
+                     "PRIMARY KEY (key, qc, ac))")
+        conn.commit()
+
+    def conn(self):
+        # a connection must not cross a fork: each worker opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_many(self, pairs):
+        """
+        :return: {(qc, ac): pf_res} for the pairs already in the cache.
+        """
+        res = {}
+        cur = self.conn().cursor()
+        for qc, ac in pairs:
+            row = cur.execute("SELECT pf_res FROM pairs WHERE key = ? AND qc = ? AND ac = ?",
+                              (self.key, qc, ac)).fetchone()
+            if row is not None:
+                res[(qc, ac)] = json.loads(row[0])
+        self.hits += len(res)
+        self.misses += len(pairs) - len(res)
+        return res
+
+    def put_many(self, results):
+        """
+        :param results: list of (qc, ac, pf_res).
+        """
+        self.conn().executemany("INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?)",
+                                [(self.key, qc, ac, json.dumps(pf_res)) for qc, ac, pf_res in results])
+
+    def commit(self):
+        self.conn().commit()
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.commit()
+            self._conn.close()
+        self._conn = None
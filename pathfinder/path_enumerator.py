@@ -0,0 +1,245 @@
+"""
+Bounded simple-path enumeration on a CPNetGraph.
+
+Paths are built by a meet-in-the-middle search: the target is expanded backwards for max_len // 2 hops into
+"walk frontiers" (frontiers[j] holds every node that reaches the target by a walk of exactly j edges), and a
+depth-first search from the source only follows neighbors that can still meet one of those frontiers in the
+remaining number of hops. The last hop is a join against the target's 1-hop frontier, so no dead-end partial
+path is ever extended to full length.
+
+Paths are produced length by length, and inside one length in lexicographic order of the neighbor order of
+`graph.neighbors`, which is the order `nx.all_simple_paths` yielded them on the old nx.Graph `cpnet_simple`
+(CPNetGraph keeps its adjacency order, see cpnet_graph.py). Enumeration stops as soon as `max_paths` paths are
+collected, so the order decides which paths are kept for pairs with more than `max_paths` paths;
+check_path_parity.py compares the result with the old search.
+
+With `min_hop_score` (needs the edge plausibility table from edge_scoring.py) the search only follows hops
+whose plausibility reaches the threshold, so weak edges are pruned during the search instead of after it.
+
+`best_first_paths` goes one step further and fuses finding, scoring and pruning: it expands partial paths in
+order of the running product of their hop plausibilities (an upper bound of the final path score, since every
+hop factor is <= 1) and drops a partial path as soon as that bound falls below the pruning threshold.
+Its result is not the output of path_scoring.py + path_pruning.py: those score and prune the first `max_paths`
+paths in shortest-first order, while best_first_paths keeps the `max_paths` best-scoring paths of any length up
+to `max_len`. An optional per-length beam (`beam_width`) expands only the best partial paths of every length,
+which keeps hub pairs from exploring their whole 3-hop neighborhood, at the price of missing paths whose
+prefixes were not among the best of their length.
+"""
+
+import heapq
+
+import numpy as np
+
+
+def isin_sorted(nodes, frontier):
+    """
+    Boolean mask of the entries of `nodes` that occur in the sorted array `frontier`.
+    """
+    if len(frontier) == 0:
+        return np.zeros(len(nodes), dtype=bool)
+    idx = np.searchsorted(frontier, nodes)
+    idx[idx == len(frontier)] = 0
+    return frontier[idx] == nodes
+
+
+def walk_frontiers(graph, target, depth, min_hop_score=None):
+    """
+    frontiers[j] (j = 0..depth) is the sorted array of nodes that reach `target` by a walk of exactly j edges.
+    A simple path with j hops left can only continue through a node of frontiers[j].
+    """
+    frontiers = [np.array([target], dtype=graph.indices.dtype)]
+    for _ in range(depth):
+        frontiers.append(graph.expand(frontiers[-1], min_hop_score))
+    return frontiers
+
+
+def within_frontiers(frontiers):
+    """
+    within[j] is the sorted array of nodes that reach the target in at most j edges.
+    """
+    within = [frontiers[0]]
+    for frontier in frontiers[1:]:
+        within.append(np.union1d(within[-1], frontier))
+    return within
+
+
+def frontier_depth(max_len):
+    # the backward half of the search; at least one hop so that the last hop is always a join
+    return max(1, max_len // 2)
+
+
+def paths_of_length(graph, source, target, length, frontiers, limit, neighbors=None, min_hop_score=None):
+    """
+    The first `limit` simple paths from source to target with exactly `length` edges, in lexicographic order
+    of the neighbor order.
+    :param neighbors: neighbor lookup to use instead of `graph.neighbors`, e.g. one memoized across targets.
+    """
+    if neighbors is None:
+        neighbors = lambda u: graph.neighbors(u, min_hop_score)
+    res = []
+    if length == 1:
+        if graph.has_edge(source, target, min_hop_score):
+            res.append([source, target])
+        return res
+
+    def extend(path, remaining):
+        nbrs = neighbors(path[-1])
+        if remaining - 1 < len(frontiers):
+            nbrs = nbrs[isin_sorted(nbrs, frontiers[remaining - 1])]
+        for x in nbrs.tolist():
+            if x == target or x in path:
+                continue
+            if remaining == 2:  # x is adjacent to the target: join
+                res.append(path + [x, target])
+            else:
+                extend(path + [x], remaining - 1)
+            if len(res) >= limit:
+                return
+
+    extend([source], length)
+    return res
+
+
+def enumerate_paths(graph, source, target, max_len=4, max_paths=100, frontiers=None, neighbors=None,
+                    min_hop_score=None):
+    """
+    Shortest-first simple paths between two concepts with at most `max_len` edges, capped at `max_paths`.
+    Gives the same paths as running `nx.all_simple_paths` with cutoff 1, 2, ..., max_len and keeping the first
+    `max_paths` distinct ones.
+    :param frontiers: precomputed `walk_frontiers(graph, target, frontier_depth(max_len))`, to share across sources.
+    :param neighbors: neighbor lookup to share across targets (see `enumerate_paths_batch`).
+    :param min_hop_score: only use hops with at least this plausibility.
+    """
+    if source == target:
+        return []
+    if frontiers is None:
+        frontiers = walk_frontiers(graph, target, frontier_depth(max_len), min_hop_score)
+
+    all_path = []
+    for length in range(1, max_len + 1):
+        all_path += paths_of_length(graph, source, target, length, frontiers, max_paths - len(all_path), neighbors,
+                                    min_hop_score)
+        if len(all_path) >= max_paths:
+            break
+    return all_path
+
+
+def enumerate_paths_batch(graph, sources, targets, max_len=4, max_paths=100, min_hop_score=None, cache=None):
+    """
+    Paths for every (source, target) pair of one statement. The backward frontiers of each target are computed
+    once and joined against every source, and the forward neighborhoods expanded from the sources are memoized,
+    so concepts shared by several pairs are only expanded once.
+    :param cache: a NeighborhoodCache (built with min_score=min_hop_score) to share expansions across statements.
+    :return: {(source, target): paths}, each entry identical to `enumerate_paths(graph, source, target, ...)`.
+    """
+    if cache is not None:
+        assert cache.min_score == min_hop_score
+        neighbors = cache.neighbors
+        get_frontiers = cache.frontiers
+    else:
+        memo = {}
+
+        def neighbors(u):
+            if u not in memo:
+                memo[u] = graph.neighbors(u, min_hop_score)
+            return memo[u]
+
+        def get_frontiers(t, depth):
+            return walk_frontiers(graph, t, depth, min_hop_score)
+
+    res = {}
+    for t in targets:
+        frontiers = get_frontiers(t, frontier_depth(max_len))
+        for s in sources:
+            res[(s, t)] = enumerate_paths(graph, s, t, max_len, max_paths, frontiers, neighbors, min_hop_score)
+    return res
+
+
+def best_first_paths(graph, source, target, max_len=4, max_paths=100, threshold=0.15, frontiers=None,
+                     neighbor_scores=None, beam_width=None):
+    """
+    The `max_paths` most plausible simple paths with at most `max_len` edges whose score (product of hop
+    plausibilities, as in `path_scoring.score_triples`) is at least `threshold`, sorted shortest-first and then
+    by decreasing score. Needs the edge plausibility table of the graph.
+    :param frontiers: precomputed `within_frontiers(walk_frontiers(graph, target, depth, threshold))`.
+    :param beam_width: if given, at most this many partial paths of every length are expanded, and every
+        expansion only queues its `beam_width` best continuations (plus the target). Partial paths come out of
+        the heap by decreasing bound, so the expanded ones are the best of their length. The default (None)
+        searches exhaustively; a beam is approximate.
+    :return: (paths, scores)
+    """
+    if source == target:
+        return [], []
+    if frontiers is None:
+        frontiers = within_frontiers(walk_frontiers(graph, target, frontier_depth(max_len), threshold))
+    if neighbor_scores is None:
+        neighbor_scores = graph.neighbor_scores
+
+    found = []
+    heap = [(-1.0, [source])]
+    expanded = [0] * (max_len + 1)  # expanded partial paths per number of edges
+    while heap and len(found) < max_paths:
+        neg_score, path = heapq.heappop(heap)
+        if path[-1] == target:  # complete paths come out in order of their final score
+            found.append((path, -neg_score))
+            continue
+        remaining = max_len - (len(path) - 1)
+        if remaining == 0:
+            continue
+        if beam_width is not None:
+            if expanded[len(path) - 1] >= beam_width:
+                continue
+            expanded[len(path) - 1] += 1
+        nbrs, scores = neighbor_scores(path[-1])
+        bounds = scores * -neg_score
+        keep = bounds >= threshold
+        if remaining - 1 < len(frontiers):
+            keep &= isin_sorted(nbrs, frontiers[remaining - 1])
+        nbrs, bounds = nbrs[keep], bounds[keep]
+        if beam_width is not None and len(nbrs) > 0:
+            # the target is always queued: complete paths are not expanded, so the beam does not apply to them
+            if expanded[len(path)] >= beam_width:  # the beam of the next length is already full
+                best = nbrs == target
+                nbrs, bounds = nbrs[best], bounds[best]
+            elif len(nbrs) > beam_width:
+                best = nbrs == target
+                best[np.argpartition(-bounds, beam_width - 1)[:beam_width]] = True
+                nbrs, bounds = nbrs[best], bounds[best]
+        for x, bound in zip(nbrs.tolist(), bounds.tolist()):
+            if x in path:
+                continue
+            heapq.heappush(heap, (-bound, path + [x]))
+
+    found.sort(key=lambda item: (len(item[0]), -item[1]))
+    return [p for p, _ in found], [sc for _, sc in found]
+
+
+def best_first_paths_batch(graph, sources, targets, max_len=4, max_paths=100, threshold=0.15, cache=None,
+                           beam_width=None):
+    """
+    best_first_paths for every (source, target) pair of one statement, sharing frontiers and neighbor lookups.
+    :param cache: a NeighborhoodCache (built with min_score=threshold) to share them across statements.
+    :return: {(source, target): (paths, scores)}
+    """
+    if cache is not None:
+        assert cache.min_score == threshold
+        neighbor_scores = cache.neighbor_scores
+        get_frontiers = cache.within_frontiers
+    else:
+        memo = {}
+
+        def neighbor_scores(u):
+            if u not in memo:
+                memo[u] = graph.neighbor_scores(u)
+            return memo[u]
+
+        def get_frontiers(t, depth):
+            return within_frontiers(walk_frontiers(graph, t, depth, threshold))
+
+    res = {}
+    for t in targets:
+        frontiers = get_frontiers(t, frontier_depth(max_len))
+        for s in sources:
+            res[(s, t)] = best_first_paths(graph, s, t, max_len, max_paths, threshold, frontiers, neighbor_scores,
+                                           beam_width)
+    return res
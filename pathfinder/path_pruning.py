@@ -1,46 +1,41 @@
-import pickle
+"""
+Threshold sweep over the path scores of path_scoring.py: the paths are sorted by score once, and every
+threshold is then only a cut in that order. Prints the keep rate of each threshold; the training / graph
+generation code reads "pf file + threshold" directly through load_pf(..., threshold=), so writing a pruned
+copy (--write) is only needed for consumers outside this repo.
+"""
+
+import argparse
 from tqdm import tqdm
-
-import sys
-flag = sys.argv[1]
-threshold = 0.15
-ori_pckle_file = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf.pickle"%flag
-scores_pckle_file = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf.cls.scores.pickle"%flag
-pruned_pckle_file = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf.cls.pruned.%s.pickle"%(flag, str(threshold))
-
-# threshold = 0.75
-# threshold = 0.15
-
-
-ori_paths = []
-with open(ori_pckle_file, "rb") as fi:
-    ori_paths = pickle.load(fi)
-
-all_scores = []
-with open(scores_pckle_file, "rb") as fi:
-    all_scores = pickle.load(fi)
-
-
-assert len(ori_paths) == len(all_scores)
-
-ori_len = 0
-pruned_len = 0
-for index, qa_pairs in tqdm(enumerate(ori_paths[:]), desc="Scoring the paths", total=len(ori_paths)):
-    for qa_idx, qas in enumerate(qa_pairs):
-        statement_paths = qas["pf_res"]
-        if statement_paths is not None:
-            pruned_statement_paths = []
-            for pf_idx, item in enumerate(statement_paths):
-                score = all_scores[index][qa_idx][pf_idx]
-                if score >= threshold:
-                    pruned_statement_paths.append(item)
-            ori_len += len(ori_paths[index][qa_idx]["pf_res"])
-            pruned_len += len(pruned_statement_paths)
-            assert len(ori_paths[index][qa_idx]["pf_res"]) >= len(pruned_statement_paths)
-            ori_paths[index][qa_idx]["pf_res"] = pruned_statement_paths
-
-print("ori_len:", ori_len, "\t\tafter_pruned_len:", pruned_len, "keep rate: %.4f"%(pruned_len/ori_len))
-print("saving the pruned paths")
-with open(pruned_pckle_file, 'wb') as fp:
-    pickle.dump(ori_paths, fp, protocol=pickle.HIGHEST_PROTOCOL)
-print("done!")
\ No newline at end of file
+from pf_store import load_pf, load_concept_vocab, load_path_scores, scores_prefix, statement_path_offsets, \
+    ScoreIndex, PrunedPF, PFStoreWriter, paths_fingerprint
+
+
+# python path_pruning.py train 0.05 0.1 0.15 0.2 0.3
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("flag", help="train / dev / test")
+    parser.add_argument("thresholds", type=float, nargs="*", default=[0.15])
+    parser.add_argument("--write", action="store_true", help="also write a pruned store for every threshold")
+    args = parser.parse_args()
+
+    ori_pf_file = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf" % args.flag
+
+    ori_paths = load_pf(ori_pf_file)
+    index = ScoreIndex(statement_path_offsets(ori_paths),
+                       load_path_scores(scores_prefix(ori_pf_file), paths_fingerprint(ori_paths)))
+
+    print("ori_len:", len(index))
+    for stats in index.sweep(args.thresholds):
+        print("threshold: %s\t\tafter_pruned_len: %d\tkeep rate: %.4f\tstatements without paths: %d" %
+              (str(stats["threshold"]), stats["kept"], stats["keep_rate"], stats["empty_statements"]))
+
+    if args.write:
+        concept2id, _ = load_concept_vocab()  # the pickle has concept strings, the packed store has ids
+        for threshold in args.thresholds:
+            pruned_pf_file = "%s.cls.pruned.%s" % (ori_pf_file, str(threshold))
+            pruned = PrunedPF(ori_paths, index.statement_path_offsets, index.keep_mask(threshold))
+            with PFStoreWriter(pruned_pf_file, concept2id) as writer:
+                for qa_pairs in tqdm(pruned, desc="writing %s" % pruned_pf_file, total=len(pruned)):
+                    writer.add_statement(qa_pairs)
+    print("done!")
@@ -10,6 +10,12 @@ import numpy as np
 import os
 from os import sys, path
 import random
+from collections import OrderedDict
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+from pf_store import load_pf, pack_statements, flatten_path_scores, statement_path_offsets, paths_fingerprint, \
+    save_path_scores
+from grounding.mcp_store import load_mcp
 
 # sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 # from embeddings.TransE import *
@@ -39,12 +45,8 @@ mcp_py_filenmae = None
 def load_resources(method):
 
     global concept2id, id2concept, concept_embs, relation2id, id2relation, relation_embs
-    concept2id = {}
-    id2concept = {}
-    with open(config["paths"]["concept_vocab"], "r", encoding="utf8") as f:
-        for w in f.readlines():
-            concept2id[w.strip()] = len(concept2id)
-            id2concept[len(id2concept)] = w.strip()
+    concept_vocab = load_vocab(config["paths"]["concept_vocab"])
+    concept2id, id2concept = concept_vocab.to_dict(), concept_vocab.id2word  # context embeddings look up every qc/ac
 
     print("concept2id done")
 
@@ -54,13 +56,8 @@ def load_resources(method):
 
     if method == "triple_cls":
 
-        relation2id = {}
-        id2relation = {}
-
-        with open(config["paths"]["relation_vocab"], "r", encoding="utf8") as f:
-            for w in f.readlines():
-                relation2id[w.strip()] = len(relation2id)
-                id2relation[len(id2relation)] = w.strip()
+        relation_vocab = load_vocab(config["paths"]["relation_vocab"])
+        relation2id, id2relation = relation_vocab.word2id, relation_vocab.id2word
 
         print("relation2id done")
 
@@ -219,6 +216,173 @@ def score_triples(concept_id, relation_id, debug=False):
     return res
 
 
+# relations that are scored in both directions (antonym and relatedto), see score_triples
+SYMMETRIC_RELATIONS = {0: 17, 17: 0, 15: 32, 32: 15}
+
+
+def score_hops_batch(heads, tails, rels, relset_offsets):
+    """
+    Vectorized score_triple for many hops at once.
+    :param heads, tails: concept id of the two ends of each hop.
+    :param rels, relset_offsets: relation ids of all hops, hop h has rels[relset_offsets[h]:relset_offsets[h+1]].
+    :return: float64 array with the max-over-relations score of each hop.
+    """
+    global relation_embs, concept_embs
+    num_rels = len(relation_embs)
+    relset_offsets = np.asarray(relset_offsets) - relset_offsets[0]
+    rels = np.asarray(rels, dtype=np.int64)
+    hop_ids = np.repeat(np.arange(len(heads)), np.diff(relset_offsets))
+
+    h = concept_embs[np.asarray(heads)[hop_ids]].astype(np.float64)
+    t = concept_embs[np.asarray(tails)[hop_ids]].astype(np.float64)
+    r = relation_embs[rels % num_rels].astype(np.float64)
+    forward = t - h  # relations >= 17 are inverse: swap head and tail, i.e. use h - t
+
+    def entry_scores(flip):
+        vec = np.where(flip[:, None], -forward, forward)
+        cos = np.einsum("ij,ij->i", r, vec) / np.sqrt(np.einsum("ij,ij->i", r, r) * np.einsum("ij,ij->i", vec, vec))
+        return (1 + 1 - np.clip(1.0 - cos, 0.0, 2.0)) / 2  # same formula as scipy's cosine distance
+
+    inverse = rels >= num_rels
+    scores = entry_scores(inverse)
+    # antonym / relatedto also count in the other direction
+    symmetric = np.isin(rels, list(SYMMETRIC_RELATIONS))
+    scores[symmetric] = np.maximum(scores[symmetric], entry_scores(~inverse)[symmetric])
+
+    hop_scores = np.full(len(heads), -10.0)
+    lens = np.diff(relset_offsets)
+    nonempty = lens > 0
+    if len(scores) > 0:
+        hop_scores[nonempty] = np.maximum.reduceat(scores, relset_offsets[:-1][nonempty])
+    return hop_scores
+
+
+class HopScoreCache(object):
+    """
+    Bounded LRU cache of hop scores keyed by (head, tail, relation-set bitmask). The same qc->neighbor hops
+    recur across the answer choices of a question and across questions, so most hops are only scored once.
+    Every distinct hop costs a dict lookup in front of the vectorized scorer, so the cache only pays off when
+    most hops repeat (break-even between ~70% and ~90% hits, depending on the data); score_paths only uses it
+    when asked to.
+    """
+
+    def __init__(self, maxsize=2000000):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        score = self.cache.get(key)
+        if score is not None:
+            self.cache.move_to_end(key)
+        return score
+
+    def put(self, key, score):
+        self.cache[key] = score
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self):
+        return "hop score cache: %d hits, %d misses, hit rate %.4f, %d entries" % (
+            self.hits, self.misses, self.hit_rate(), len(self.cache))
+
+
+def gather_segments(values, offsets, idx):
+    """
+    Concatenates the segments values[offsets[i]:offsets[i+1]] for i in idx.
+    :return: (flat values, offsets of the gathered segments)
+    """
+    starts = offsets[idx]
+    lens = offsets[idx + 1] - starts
+    new_offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+    np.cumsum(lens, out=new_offsets[1:])
+    positions = np.repeat(starts - new_offsets[:-1], lens) + np.arange(new_offsets[-1])
+    return values[positions], new_offsets
+
+
+def score_hops_cached(heads, tails, rels, relset_offsets, cache):
+    """
+    score_hops_batch, but only for hops that are neither repeated inside this batch nor already in `cache`.
+    """
+    relset_offsets = np.asarray(relset_offsets) - relset_offsets[0]
+    rels = np.asarray(rels, dtype=np.int64)
+    lens = np.diff(relset_offsets)
+    rel_masks = np.zeros(len(heads), dtype=np.int64)
+    if len(rels) > 0:
+        rel_masks[lens > 0] = np.bitwise_or.reduceat(np.left_shift(1, rels), relset_offsets[:-1][lens > 0])
+    keys = np.stack([heads, tails, rel_masks], axis=1)
+    unique_keys, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+
+    unique_scores = np.zeros(len(unique_keys))
+    missing = []
+    for k, key in enumerate(map(tuple, unique_keys.tolist())):
+        score = cache.get(key)
+        if score is None:
+            missing.append(k)
+        else:
+            unique_scores[k] = score
+    missing = np.asarray(missing, dtype=np.int64)
+    if len(missing) > 0:
+        hops = first[missing]
+        miss_rels, miss_offsets = gather_segments(rels, relset_offsets, hops)
+        unique_scores[missing] = score_hops_batch(heads[hops], tails[hops], miss_rels, miss_offsets)
+        for key, score in zip(map(tuple, unique_keys[missing].tolist()), unique_scores[missing].tolist()):
+            cache.put(key, score)
+    cache.misses += len(missing)
+    cache.hits += len(heads) - len(missing)
+    return unique_scores[inverse.reshape(-1)]
+
+
+def score_triples_batch(concepts, path_offsets, rels, relset_offsets, chunk_size=100000, cache=None):
+    """
+    Vectorized score_triples over many paths given as flat arrays (the layout of a packed .pf store).
+    :param cache: optional HopScoreCache, so that repeated hops are looked up instead of recomputed.
+    :return: float64 array with one score per path, the product of its hop scores.
+    """
+    num_paths = len(path_offsets) - 1
+    path_scores = np.zeros(num_paths)
+    for lo in tqdm(range(0, num_paths, chunk_size), desc="Scoring the paths"):
+        hi = min(lo + chunk_size, num_paths)
+        offsets = np.asarray(path_offsets[lo:hi + 1])
+        cpts = np.asarray(concepts[offsets[0]:offsets[-1]])
+        offsets = offsets - offsets[0]
+        is_head = np.ones(len(cpts), dtype=bool)
+        is_head[offsets[1:] - 1] = False  # the last concept of a path starts no hop
+        heads = np.flatnonzero(is_head)
+        hop_lo, hop_hi = int(path_offsets[lo]) - lo, int(path_offsets[hi]) - hi
+        rel_offsets = np.asarray(relset_offsets[hop_lo:hop_hi + 1])
+        hop_rels = rels[rel_offsets[0]:rel_offsets[-1]]
+        if cache is not None:
+            hop_scores = score_hops_cached(cpts[heads], cpts[heads + 1], hop_rels, rel_offsets, cache)
+        else:
+            hop_scores = score_hops_batch(cpts[heads], cpts[heads + 1], hop_rels, rel_offsets)
+        hop_offsets = offsets[:-1] - np.arange(hi - lo)
+        path_scores[lo:hi] = np.multiply.reduceat(hop_scores, hop_offsets)
+    return path_scores
+
+
+def split_path_scores(store, path_scores):
+    """
+    Regroups per-path scores into the all_scores layout: all_scores[statement][pair] is a list or None.
+    """
+    all_scores = []
+    pair_offsets = np.asarray(store.pair_offsets)
+    for i in range(len(store)):
+        statement_scores = []
+        for j in store.statement_pairs(i):
+            if store.pair_found[j]:
+                statement_scores.append(path_scores[pair_offsets[j]:pair_offsets[j + 1]].tolist())
+            else:
+                statement_scores.append(None)
+        all_scores.append(statement_scores)
+    return all_scores
+
+
 def context_per_qa(acs, qcs, pooling="mean"):
     '''
     calculate the context embedding for each q-a statement in terms of mentioned concepts
@@ -254,6 +418,68 @@ def path_scoring(path, context):
         return 1.0 # the source and target of the paths are qa concepts
 
 
+def context_embs_batch(qcs_list, acs_list, pooling="mean", chunk_size=10000):
+    """
+    context_per_qa for many statements at once: the distinct concept ids of every statement form one CSR
+    (ids + offsets) and each chunk of statements is pooled with a single reduceat over the gathered embeddings.
+    Statements without concepts get NaN, like the mean of an empty selection.
+    """
+    global concept2id, concept_embs
+    num_statements = len(qcs_list)
+    ids = []
+    offsets = np.zeros(num_statements + 1, dtype=np.int64)
+    for i, (qcs, acs) in enumerate(zip(qcs_list, acs_list)):
+        concept_ids = set(concept2id[c] for c in qcs) | set(concept2id[c] for c in acs)
+        ids.extend(concept_ids)
+        offsets[i + 1] = len(ids)
+    ids = np.asarray(ids, dtype=np.int64)
+    counts = np.diff(offsets)
+
+    embs = np.full((num_statements, concept_embs.shape[1]), np.nan)
+    for lo in range(0, num_statements, chunk_size):
+        hi = min(lo + chunk_size, num_statements)
+        nonempty = np.flatnonzero(counts[lo:hi] > 0) + lo
+        if len(nonempty) == 0:
+            continue
+        vecs = concept_embs[ids[offsets[lo]:offsets[hi]]].astype(np.float64)
+        starts = offsets[nonempty] - offsets[lo]
+        if pooling == "mean":
+            embs[nonempty] = np.add.reduceat(vecs, starts, axis=0) / counts[nonempty][:, None]
+        else:
+            embs[nonempty] = np.maximum.reduceat(vecs, starts, axis=0)
+    return embs
+
+
+def path_context_scores(concepts, path_offsets, path_statement, context_embs, chunk_size=1000000):
+    """
+    `path_scoring` for all paths at once: the cosine similarity of every middle concept of a path with the
+    context embedding of its statement, minimum per path (1.0 for paths without middle concepts).
+    :param concepts, path_offsets: paths in the flat layout of pf_store.
+    :param path_statement: statement index of every path.
+    """
+    global concept_embs
+    num_paths = len(path_offsets) - 1
+    path_offsets = np.asarray(path_offsets, dtype=np.int64)
+    path_scores = np.ones(num_paths)
+    context_norms = np.linalg.norm(context_embs, axis=1)
+    for lo in range(0, num_paths, chunk_size):
+        hi = min(lo + chunk_size, num_paths)
+        starts, ends = path_offsets[lo:hi] + 1, path_offsets[lo + 1:hi + 1] - 1  # middle concepts only
+        lens = np.maximum(ends - starts, 0)
+        has_middle = lens > 0
+        if not has_middle.any():
+            continue
+        positions = np.repeat(starts[has_middle] - np.cumsum(lens[has_middle]) + lens[has_middle],
+                              lens[has_middle]) + np.arange(lens.sum())
+        vecs = concept_embs[np.asarray(concepts[positions], dtype=np.int64)].astype(np.float64)
+        statements = np.repeat(np.asarray(path_statement[lo:hi])[has_middle], lens[has_middle])
+        sims = np.einsum("ij,ij->i", vecs, context_embs[statements]) / \
+            (np.linalg.norm(vecs, axis=1) * context_norms[statements])
+        seg_starts = np.concatenate([[0], np.cumsum(lens[has_middle])[:-1]])
+        path_scores[lo + np.flatnonzero(has_middle)] = np.minimum.reduceat(sims, seg_starts)
+    return path_scores
+
+
 def calc_context_emb(pooling="mean", filename =""):
     global mcp_py_filenmae
     mcp_py_filenmae = filename + "." + pooling + ".npy"
@@ -261,33 +487,24 @@ def calc_context_emb(pooling="mean", filename =""):
         print(mcp_py_filenmae, "exists!")
         return
 
-    with open(filename, "rb") as f:
-        mcp = json.load(f)
-
-    embs = []
-
-    for s in tqdm(mcp, desc="Computing concept-context embedding.."):
-        qcs = s["qc"]
-        acs = s["ac"]
-
-        embs.append(context_per_qa(acs=acs, qcs=qcs, pooling=pooling))
+    mcp = load_mcp(filename, id2concept)  # id2concept is the shared concept Vocab
 
+    print("Computing concept-context embedding..")
+    embs = context_embs_batch([s["qc"] for s in mcp], [s["ac"] for s in mcp], pooling=pooling)
 
-    embs = np.asarray(embs)
     print("output_path: " + mcp_py_filenmae)
     np.save(mcp_py_filenmae, embs)
 
 
 
 
-def score_paths(filename, score_filename, method, debug=False, debug_range=None):
+def score_paths(filename, score_filename, method, debug=False, debug_range=None, hop_cache=False):
 
     global id2concept, mcp_py_filenmae
 
     print("Loading paths")
 
-    with open(filename, "rb") as f:
-        input = pickle.load(f)
+    input = load_pf(filename)
 
     print("Paths loaded")
 
@@ -307,34 +524,50 @@ def score_paths(filename, score_filename, method, debug=False, debug_range=None)
     else:
         pass
 
-    for index, qa_pairs in tqdm(enumerate(input), desc="Scoring the paths", total=len(input)):
-        statemetn_scores = []
-        for qa_idx, qas in enumerate(qa_pairs):
-            statement_paths = qas["pf_res"]
+    if method == "triple_cls" and not debug:
+        # score every hop of every path in a few large matrix operations
+        store = pack_statements(input)
+        cache = HopScoreCache() if hop_cache else None
+        path_scores = score_triples_batch(store.concepts, store.path_offsets, store.rels, store.relset_offsets,
+                                          cache=cache)
+        if cache is not None:
+            print(cache.stats())
+        all_scores = split_path_scores(store, path_scores)
+    elif not debug:
+        # cosine of every middle concept with its statement context, all paths at once
+        store = pack_statements(input)
+        path_statement = np.repeat(np.arange(len(store)), np.diff(statement_path_offsets(store)))
+        path_scores = path_context_scores(store.concepts, store.path_offsets, path_statement, context_embs)
+        all_scores = split_path_scores(store, path_scores)
+    else:
+        for index, qa_pairs in tqdm(enumerate(input), desc="Scoring the paths", total=len(input)):
+            statemetn_scores = []
+            for qa_idx, qas in enumerate(qa_pairs):
+                statement_paths = qas["pf_res"]
 
-            if statement_paths is not None:
+                if statement_paths is not None:
 
-                if not method == "triple_cls":
+                    if not method == "triple_cls":
 
-                    context_emb = context_embs[index]
+                        context_emb = context_embs[index]
 
-                path_scores = []
-                for pf_idx, item in enumerate(statement_paths):
+                    path_scores = []
+                    for pf_idx, item in enumerate(statement_paths):
 
-                    assert len(item["path"]) > 1
-                    # vanila_score_triples(concept_id=item["path"], relation_id=item["rel"])
+                        assert len(item["path"]) > 1
+                        # vanila_score_triples(concept_id=item["path"], relation_id=item["rel"])
 
-                    if not method == "triple_cls":
-                        score = path_scoring(path=item["path"], context=context_emb)
+                        if not method == "triple_cls":
+                            score = path_scoring(path=item["path"], context=context_emb)
 
-                    else:
-                        score = score_triples(concept_id=item["path"], relation_id=item["rel"], debug=debug)
-                    path_scores.append(score)
-                statemetn_scores.append(path_scores)
-            else:
-                statemetn_scores.append(None)
+                        else:
+                            score = score_triples(concept_id=item["path"], relation_id=item["rel"], debug=debug)
+                        path_scores.append(score)
+                    statemetn_scores.append(path_scores)
+                else:
+                    statemetn_scores.append(None)
 
-        all_scores.append(statemetn_scores)
+            all_scores.append(statemetn_scores)
 
 
 
@@ -343,14 +576,17 @@ def score_paths(filename, score_filename, method, debug=False, debug_range=None)
         print("saving the path scores")
         with open(score_filename, 'wb') as fp:
             pickle.dump(all_scores, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        # flat copy in store order, for threshold sweeps (path_pruning.py) and load_pf(..., threshold=)
+        save_path_scores(score_filename[:-len(".pickle")], flatten_path_scores(all_scores), paths_fingerprint(store))
         print("done!")
 
+# python path_scoring.py train [hop_cache]
 if __name__=="__main__":
     import sys
     flag = sys.argv[1]
     method = "triple_cls" #
     mcp_file = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp"%flag
-    ori_pckle_file = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf.pickle"%flag
+    ori_pf_file = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf"%flag
     scores_pckle_file = "../datasets/csqa_new/%s_rand_split.jsonl.statements.mcp.pf.cls.scores.pickle"%flag
 
     '''to calculate the context embedding for qas'''
@@ -359,9 +595,10 @@ if __name__=="__main__":
 
     if not method == "triple_cls":
         calc_context_emb(filename=mcp_file)
-    # score_paths(filename=ori_pckle_file, score_filename=scores_pckle_file, method=method, debug=True, debug_range=(10, 11))
+    # score_paths(filename=ori_pf_file, score_filename=scores_pckle_file, method=method, debug=True, debug_range=(10, 11))
 
-    score_paths(filename=ori_pckle_file, score_filename=scores_pckle_file, method=method, debug=False)
+    score_paths(filename=ori_pf_file, score_filename=scores_pckle_file, method=method, debug=False,
+                hop_cache="hop_cache" in sys.argv[2:])
 
-    # score_paths(filename=ori_pckle_file, score_filename=scores_pckle_file, method=method, debug=True,
+    # score_paths(filename=ori_pf_file, score_filename=scores_pckle_file, method=method, debug=True,
     #                 debug_range=(11, 12))
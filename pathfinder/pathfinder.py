@@ -1,5 +1,4 @@
 import configparser
-import networkx as nx
 import itertools
 import math
 import random
@@ -9,6 +8,16 @@ import sys
 import time
 import timeit
 import numpy as np
+import multiprocessing
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+from cpnet_graph import CPNetGraph, csr_file
+from path_enumerator import enumerate_paths, enumerate_paths_batch, best_first_paths_batch, frontier_depth
+from neighborhood_cache import NeighborhoodCache, hot_concepts
+from pair_cache import PairCache, graph_fingerprint
+from jsonl_io import ResumableJsonlWriter, read_checkpoint
+from grounding.mcp_store import load_mcp, shard
 
 
 config = configparser.ConfigParser()
@@ -21,50 +30,39 @@ concept2id = None
 relation2id = None
 id2relation = None
 id2concept = None
+min_hop_score = None  # set from --min_hop_score: prune hops below this plausibility during the search
+score_threshold = None  # set from --score_threshold: fused find-score-prune with best-first search
+beam_width = None  # set from --beam_width: partial paths of every length expanded by the best-first search
+nbr_cache = None  # NeighborhoodCache shared by all statements of a worker
+pair_cache = None  # PairCache of finished (qc, ac) results: read by the workers, written by the parent
 
 
 
 
 def load_resources():
     global concept2id, relation2id, id2relation, id2concept
-    concept2id = {}
-    id2concept = {}
-    with open(config["paths"]["concept_vocab"], "r", encoding="utf8") as f:
-        for w in f.readlines():
-            concept2id[w.strip()] = len(concept2id)
-            id2concept[len(id2concept)] = w.strip()
+    concept_vocab = load_vocab(config["paths"]["concept_vocab"])  # memory-mapped, shared by the forked workers
+    concept2id, id2concept = concept_vocab.word2id, concept_vocab.id2word
 
     print("concept2id done")
-    id2relation = {}
-    relation2id = {}
-    with open(config["paths"]["relation_vocab"], "r", encoding="utf8") as f:
-        for w in f.readlines():
-            id2relation[len(id2relation)] = w.strip()
-            relation2id[w.strip()] = len(relation2id)
+    relation_vocab = load_vocab(config["paths"]["relation_vocab"])
+    relation2id, id2relation = relation_vocab.word2id, relation_vocab.id2word
     print("relation2id done")
 
 def load_cpnet():
-    global cpnet,concept2id, relation2id, id2relation, id2concept, cpnet_simple
+    global cpnet,concept2id, relation2id, id2relation, id2concept, score_threshold, min_hop_score
     print("loading cpnet....")
-    cpnet = nx.read_gpickle(config["paths"]["conceptnet_en_graph"])
+    cpnet = CPNetGraph(config["paths"]["conceptnet_en_csr"])
+    for flag, value in [("--score_threshold", score_threshold), ("--min_hop_score", min_hop_score)]:
+        if value is not None and cpnet.score is None:
+            raise ValueError("%s needs the edge scores %s, run edge_scoring.py first"
+                             % (flag, csr_file(cpnet.prefix, "score")))
     print("Done")
 
-    cpnet_simple = nx.Graph()
-    for u, v, data in cpnet.edges(data=True):
-        w = data['weight'] if 'weight' in data else 1.0
-        if cpnet_simple.has_edge(u, v):
-            cpnet_simple[u][v]['weight'] += w
-        else:
-            cpnet_simple.add_edge(u, v, weight=w)
-
 
 def get_edge(src_concept, tgt_concept):
     global cpnet, concept2id, relation2id, id2relation, id2concept
-    rel_list = cpnet[src_concept][tgt_concept]
-    # tmp = [rel_list[item]["weight"] for item in rel_list]
-    # s = tmp.index(min(tmp))
-    # rel = rel_list[s]["rel"]
-    return list(set([rel_list[item]["rel"] for item in rel_list]))
+    return cpnet.relations(src_concept, tgt_concept)
 
 # source and target is text
 def find_paths(source, target, ifprint = False):
@@ -80,26 +78,41 @@ def find_paths(source, target, ifprint = False):
     #     print("no path")
     # paths = [path]
 
-    if s not in cpnet_simple.nodes() or t not in cpnet_simple.nodes():
+    if s not in cpnet or t not in cpnet:
         return
-    # paths =
-    all_path = []
-    all_path_set = set()
-
-    for max_len in range(1, 5):
-        for p in nx.all_simple_paths(cpnet_simple, source=s, target=t, cutoff=max_len):
-            path_str = "-".join([str(c) for c in p])
-            if path_str not in all_path_set:
-                all_path_set.add(path_str)
-                all_path.append(p)
-            if len(all_path) >= 100:  # top shortest 300 paths
-                break
-        if len(all_path) >= 100:  # top shortest 300 paths
-            break
-
-    # all_path = [[int(c) for c in p.split("-")] for p in list(set(["-".join([str(c) for c in p]) for p in all_path]))]
-    # print(len(all_path))
-    all_path.sort(key=len, reverse=False)
+    all_path = enumerate_paths(cpnet, s, t, max_len=4, max_paths=100)  # top shortest 100 paths
+    return get_pf_res(all_path, ifprint)
+
+
+# qcs and acs are text; all (qc, ac) pairs of a statement share their neighborhood expansions
+def find_paths_batch(qcs, acs, max_len=4, max_paths=100):
+    global cpnet, concept2id, min_hop_score, score_threshold, beam_width, nbr_cache
+    sources = [concept2id[qc] for qc in qcs]
+    targets = [concept2id[ac] for ac in acs]
+    in_graph_sources = [s for s in sources if s in cpnet]
+    in_graph_targets = [t for t in targets if t in cpnet]
+    if score_threshold is not None:
+        # the best-scoring paths above the threshold, found without enumerating the others (not the same set
+        # as path_scoring + path_pruning, which prune the shortest paths)
+        scored_paths = best_first_paths_batch(cpnet, in_graph_sources, in_graph_targets, max_len=max_len,
+                                              max_paths=max_paths, threshold=score_threshold, cache=nbr_cache,
+                                              beam_width=beam_width)
+        all_paths = {pair: paths for pair, (paths, scores) in scored_paths.items()}
+    else:
+        all_paths = enumerate_paths_batch(cpnet, in_graph_sources, in_graph_targets, max_len=max_len,
+                                          max_paths=max_paths, min_hop_score=min_hop_score, cache=nbr_cache)
+    res = {}
+    for qc, s in zip(qcs, sources):
+        for ac, t in zip(acs, targets):
+            if (s, t) in all_paths:
+                res[(qc, ac)] = get_pf_res(all_paths[(s, t)])
+            else:
+                res[(qc, ac)] = None  # same as find_paths for concepts outside the graph
+    return res
+
+
+def get_pf_res(all_path, ifprint=False):
+    global cpnet, concept2id, relation2id, id2relation, id2concept
     pf_res = []
     for p in all_path:
         # print([id2concept[i] for i in p])
@@ -127,47 +140,189 @@ def find_paths(source, target, ifprint = False):
     return pf_res
 
 
-def process(filename, batch_id=-1):
-    pf = []
-    output_path = filename + ".%d" % (batch_id) + ".pf"
-    import os
-    if os.path.exists(output_path):
+def process_statement(item):
+    """
+    :return: the path finding results of the statement, and the (qc, ac, pf_res) results that were not in
+    pair_cache (for the parent process to add).
+    """
+    acs = item["ac"]
+    qcs = item["qc"]
+    pairs = [(qc, ac) for ac in acs for qc in qcs]
+    cached = pair_cache.get_many(pairs) if pair_cache is not None else {}
+    todo_qcs = [qc for qc in qcs if any((qc, ac) not in cached for ac in acs)]
+    todo_acs = [ac for ac in acs if any((qc, ac) not in cached for qc in todo_qcs)]
+    batch_res = find_paths_batch(todo_qcs, todo_acs)
+    pfr_qa = []  # path finding results
+    new_results = []
+    for qc, ac in pairs:
+        if (qc, ac) in cached:
+            pfr_qa.append({"ac":ac, "qc":qc, "pf_res":cached[(qc, ac)]})
+        else:
+            pfr_qa.append({"ac":ac, "qc":qc, "pf_res":batch_res[(qc, ac)]})
+            new_results.append((qc, ac, batch_res[(qc, ac)]))
+    return pfr_qa, new_results
+
+
+def cache_counts():
+    return [(c.hits, c.misses) if c is not None else (0, 0) for c in (nbr_cache, pair_cache)]
+
+
+def process_statement_with_stats(item):
+    before = cache_counts()
+    pfr_qa, new_results = process_statement(item)
+    return pfr_qa, new_results, [(h1 - h0, m1 - m0) for (h0, m0), (h1, m1) in zip(before, cache_counts())]
+
+
+def warm_cache(mcp_data, top_k, max_len=4):
+    """
+    Expands the neighborhoods of the most frequent concepts of a file into nbr_cache, before the workers fork.
+    """
+    global cpnet, concept2id, score_threshold, nbr_cache
+    hot_qcs, hot_acs = hot_concepts(mcp_data, top_k)
+    depth = frontier_depth(max_len)
+    for ac in tqdm(hot_acs, desc="warming neighborhood cache"):
+        t = concept2id[ac]
+        if t in cpnet:
+            if score_threshold is not None:
+                nbr_cache.within_frontiers(t, depth)
+            else:
+                nbr_cache.frontiers(t, depth)
+    for qc in hot_qcs:
+        s = concept2id[qc]
+        if s in cpnet:
+            if score_threshold is not None:
+                nbr_cache.neighbor_scores(s)
+            else:
+                nbr_cache.neighbors(s)
+    nbr_cache.hits, nbr_cache.misses = 0, 0
+
+
+def search_mode(max_len=4, max_paths=100):
+    global min_hop_score, score_threshold, beam_width
+    if score_threshold is not None:
+        return "best_first:%d:%d:%s:%s" % (max_len, max_paths, repr(score_threshold), repr(beam_width))
+    return "enumerate:%d:%d:%s" % (max_len, max_paths, repr(min_hop_score))
+
+
+def process(filename, batch_id=-1, num_workers=None, cache_mb=512, cache_hot=2000, cache_file=None,
+            pair_cache_file=None):
+    """
+    Finds paths for every statement of a .mcp file with a pool of worker processes.
+    The graph and vocab are loaded once before forking; the CSR arrays are memory-mapped and the vocab dicts
+    are shared copy-on-write, so memory does not grow with the number of workers. Statements are handed out
+    in small chunks as workers become idle, and results are collected in statement order.
+    Results are streamed to a JSON-lines file (one line per statement) with periodic checkpoints; if the job
+    is killed, running it again resumes after the last checkpoint.
+    :param batch_id: if >= 0, only process this 1/100 shard of the file (to split a split across machines).
+    :param num_workers: defaults to the number of cores.
+    :param cache_mb: memory budget of each worker's neighborhood cache, 0 to disable it.
+    :param cache_hot: number of most frequent question / answer concepts to expand before forking.
+    :param cache_file: if given, the warm cache is loaded from / saved to this file, so that later runs and
+    the other shards start warm.
+    :param pair_cache_file: if given, an SQLite file of finished (qc, ac) results, looked up before searching
+    and extended with every new result (see pair_cache.py).
+    """
+    global score_threshold, min_hop_score, nbr_cache, pair_cache
+    output_path = filename
+    if batch_id >= 0:
+        output_path += ".%d" % (batch_id)
+    if score_threshold is not None:
+        output_path += ".pf.cls.pruned.%s.jsonl" % str(score_threshold)  # already scored and pruned
+    else:
+        output_path += ".pf.jsonl"
+
+    mcp_data = load_mcp(filename, load_vocab(config["paths"]["concept_vocab"]))
+    if batch_id >= 0:
+        mcp_data = shard(mcp_data, batch_id)
+
+    num_done, _ = read_checkpoint(output_path)
+    if os.path.exists(output_path) and num_done == len(mcp_data):
         print(output_path + " exists. Skip!")
         return
 
     load_resources()
     load_cpnet()
-    with open(filename, 'r') as fp:
-        mcp_data = json.load(fp)
-        mcp_data = list(np.array_split(mcp_data, 100)[batch_id])
-
-        for item in tqdm(mcp_data, desc="batch_id: %d "%batch_id):
-            acs = item["ac"]
-            qcs = item["qc"]
-            pfr_qa = []  # path finding results
-            for ac in acs:
-                for qc in qcs:
-                    pf_res = find_paths(qc, ac)
-                    pfr_qa.append({"ac":ac, "qc":qc, "pf_res":pf_res})
-            pf.append(pfr_qa)
-
-    with open(output_path, 'w') as fi:
-        json.dump(pf, fi)
- 
-
-# process(sys.argv[1], int(sys.argv[2]))
-#
-
-load_resources()
-load_cpnet()
-# find_paths("fill", "fountain_pen", ifprint=True)
-# print("--------")
-# find_paths("write", "fountain_pen", ifprint=True)
-# print("--------")
-# find_paths("write", "pen", ifprint=True)
-find_paths("bottle", "liquor", ifprint=True)
-
-print();print();print();print();print();
-
-
-find_paths("cashier", "store", ifprint=True)
\ No newline at end of file
+    if cache_mb > 0:
+        nbr_cache = NeighborhoodCache(cpnet, min_hop_score if score_threshold is None else score_threshold,
+                                      max_bytes=cache_mb << 20)
+        if cache_file is not None and nbr_cache.load(cache_file):
+            print("loaded %d cached neighborhoods from %s" % (len(nbr_cache.entries), cache_file))
+        warm_cache(mcp_data, cache_hot)
+        if cache_file is not None:
+            nbr_cache.save(cache_file)
+    else:
+        nbr_cache = None
+    if pair_cache_file is not None:
+        pair_cache = PairCache(pair_cache_file, graph_fingerprint(cpnet, with_scores=score_threshold is not None
+                                                                  or min_hop_score is not None), search_mode())
+        pair_cache.close()  # reopened after the fork, connections must not be shared with the workers
+    else:
+        pair_cache = None
+
+    stats = [[0, 0], [0, 0]]  # [hits, misses] of nbr_cache and pair_cache
+    with ResumableJsonlWriter(output_path) as writer:
+        if writer.num_done > 0:
+            print("resuming %s after %d statements" % (output_path, writer.num_done))
+        todo = mcp_data[writer.num_done:]
+        with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+            for i, (pfr_qa, new_results, cache_stats) in enumerate(tqdm(
+                    pool.imap(process_statement_with_stats, todo, chunksize=4), total=len(todo),
+                    desc="pathfinding")):
+                writer.write(pfr_qa)
+                for total, (h, m) in zip(stats, cache_stats):
+                    total[0] += h
+                    total[1] += m
+                if pair_cache is not None:
+                    pair_cache.put_many(new_results)
+                    if (i + 1) % 100 == 0:
+                        pair_cache.commit()  # now visible to the workers
+    if pair_cache is not None:
+        pair_cache.close()
+    for name, (hits, misses) in zip(["neighborhood cache", "pair cache"], stats):
+        if hits + misses > 0:
+            print("%s: %d hits, %d misses, hit rate %.4f" % (name, hits, misses, hits / (hits + misses)))
+
+
+def test():
+    load_resources()
+    load_cpnet()
+    # find_paths("fill", "fountain_pen", ifprint=True)
+    # print("--------")
+    # find_paths("write", "fountain_pen", ifprint=True)
+    # print("--------")
+    # find_paths("write", "pen", ifprint=True)
+    find_paths("bottle", "liquor", ifprint=True)
+
+    print();print();print();print();print();
+
+
+    find_paths("cashier", "store", ifprint=True)
+
+
+# python pathfinder.py ../datasets/csqa_new/train_rand_split.jsonl.statements.mcp
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mcp_file")
+    parser.add_argument("batch_id", type=int, nargs="?", default=-1)
+    parser.add_argument("--num_workers", type=int, default=None)
+    parser.add_argument("--min_hop_score", type=float, default=None,
+                        help="skip hops with a lower TransE plausibility (run edge_scoring.py first)")
+    parser.add_argument("--score_threshold", type=float, default=None,
+                        help="find, score and prune in one best-first search (run edge_scoring.py first); keeps "
+                             "the best-scoring paths, not those of path_scoring.py + path_pruning.py")
+    parser.add_argument("--beam_width", type=int, default=0,
+                        help="with --score_threshold: partial paths of every length to expand (approximate), "
+                             "0: exhaustive")
+    parser.add_argument("--cache_mb", type=int, default=512, help="neighborhood cache budget per worker, 0: off")
+    parser.add_argument("--cache_hot", type=int, default=2000,
+                        help="expand the neighborhoods of this many most frequent concepts before forking")
+    parser.add_argument("--cache_file", default=None, help="persist the warm neighborhood cache across runs")
+    parser.add_argument("--pair_cache", default=None,
+                        help="SQLite file of finished (qc, ac) results, shared across splits and runs")
+    args = parser.parse_args()
+    min_hop_score = args.min_hop_score
+    score_threshold = args.score_threshold
+    beam_width = args.beam_width if args.beam_width > 0 else None
+    process(args.mcp_file, args.batch_id, args.num_workers, args.cache_mb, args.cache_hot, args.cache_file,
+            args.pair_cache)
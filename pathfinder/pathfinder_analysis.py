@@ -3,14 +3,15 @@ from tqdm import tqdm
 import json
 import timeit
 import statistics
+from pf_store import load_pf
 
 threshold = 0.17
-PF_PATH = "../datasets/csqa_new/dev_rand_split.jsonl.statements.mcp.pf.cls.pruned.%s.pickle" % (str(threshold))
+PF_PATH = "../datasets/csqa_new/dev_rand_split.jsonl.statements.mcp.pf"  # unpruned, pruned at `threshold` on load
 statement_json_file = "../datasets/csqa_new/dev_rand_split.jsonl.statements"
 flag = "pruned"
 
 
-def pathfinding_analysis(pf_pckle_file, statement_json_file, flag="original"):
+def pathfinding_analysis(pf_pckle_file, statement_json_file, flag="original", threshold=None):
     statement_json_data = []
     print("loading statements from %s" % statement_json_file)
     with open(statement_json_file, "r") as fp:
@@ -27,9 +28,7 @@ def pathfinding_analysis(pf_pckle_file, statement_json_file, flag="original"):
 
     print("loading paths from %s" % pf_pckle_file)
     start_time = timeit.default_timer()
-    path_json_data = []
-    with open(pf_pckle_file, "rb") as fi:
-        path_json_data = pickle.load(fi)
+    path_json_data = load_pf(pf_pckle_file, threshold=threshold)
     print('\t Done! Time: ', "{0:.2f} sec".format(float(timeit.default_timer() - start_time)))
 
     assert len(path_json_data) == len(labels)
@@ -45,7 +44,7 @@ def pathfinding_analysis(pf_pckle_file, statement_json_file, flag="original"):
 
     no_qa_pair = [0, 0]
 
-    for index, qa_pairs in tqdm(enumerate(path_json_data[:]), desc="Scoring the paths", total=len(path_json_data)):
+    for index, qa_pairs in tqdm(enumerate(path_json_data), desc="Scoring the paths", total=len(path_json_data)):
         qa_path_lenths = []
         coverd_qa_pair = 0
         path_counts = []
@@ -191,4 +190,4 @@ def pathfinding_analysis(pf_pckle_file, statement_json_file, flag="original"):
 
 
 
-pathfinding_analysis(PF_PATH, statement_json_file, flag)
\ No newline at end of file
+pathfinding_analysis(PF_PATH, statement_json_file, flag, threshold if flag == "pruned" else None)
\ No newline at end of file
@@ -1,22 +1,16 @@
 import timeit
-import json
-import pickle
+from pf_store import jsonl_to_store, store_to_pickle, load_concept_vocab
 
+# the .pf.pickle is derived from the packed store, so load_pf and pickle readers see the same paths
 fname = '../datasets/csqa_new/train_rand_split.jsonl.statements.mcp.pf'
-#
+concept2id, id2concept = load_concept_vocab()
+
 start_time = timeit.default_timer()
-print("loading paths from %s" % fname)
-with open(fname, 'r') as f:
-    pf_json_data = json.load(f)
-print('\t Load Json Done! Time: ', "{0:.2f} sec".format(float(timeit.default_timer() - start_time)))
+print("packing paths from %s" % (fname+'.jsonl'))
+jsonl_to_store(fname+'.jsonl', fname, concept2id)
+print('\t Pack Json Done! Time: ', "{0:.2f} sec".format(float(timeit.default_timer() - start_time)))
 
 
 start_time = timeit.default_timer()
-with open(fname+'.pickle', 'wb') as handle:
-    pickle.dump(pf_json_data, handle, protocol=pickle.HIGHEST_PROTOCOL)
+store_to_pickle(fname, fname+'.pickle', id2concept)
 print('\t Save Pickle Done! Time: ', "{0:.2f} sec".format(float(timeit.default_timer() - start_time)))
-
-# start_time = timeit.default_timer()
-# with open(fname+'.pickle', 'rb') as handle:
-#     pf_json_data = pickle.load(handle)
-# print('\t Load Pickle Done! Time: ', "{0:.2f} sec".format(float(timeit.default_timer() - start_time)))
\ No newline at end of file
@@ -0,0 +1,412 @@
+"""
+Packed, memory-mappable storage for path-finding results.
+
+The legacy .pf.pickle is a list (one entry per statement) of lists of {"ac", "qc", "pf_res"} dicts, where
+pf_res is None (a concept is not in the graph) or a list of {"path": [concept ids], "rel": [[relation ids]]}.
+A packed store keeps the same data in flat arrays under one prefix, e.g. "train_...mcp.pf":
+
+    prefix.concepts.npy           int32  concept ids of all paths, path after path
+    prefix.path_offsets.npy       int64  [num_paths + 1]     path p is concepts[path_offsets[p]:path_offsets[p+1]]
+    prefix.rels.npy               int32  relation ids of all hops, hop after hop
+    prefix.relset_offsets.npy     int64  [num_hops + 1]      hop h has rels[relset_offsets[h]:relset_offsets[h+1]]
+    prefix.pair_qc.npy            int32  [num_pairs]         question concept id of each (qc, ac) pair
+    prefix.pair_ac.npy            int32  [num_pairs]         answer concept id of each pair
+    prefix.pair_found.npy         bool   [num_pairs]         False where pf_res is None
+    prefix.pair_offsets.npy       int64  [num_pairs + 1]     paths of pair j are path_offsets[...] rows pair_offsets[j]..
+    prefix.statement_offsets.npy  int64  [num_statements + 1] pairs of statement i
+
+A path with n concepts has n - 1 hops, so the hops of path p start at hop index path_offsets[p] - p.
+
+Path scores (path_scoring.py) are kept per path, in store order, as prefix.cls.scores.npz together with the
+`paths_fingerprint` of the paths they were computed for, which is checked on load (or the legacy nested
+prefix.cls.scores.pickle). Pruning at a threshold is then a keep-mask over the paths: `load_pf(prefix,
+threshold=t)` gives a lazily filtered view instead of a new copy of the paths for every threshold.
+"""
+
+import os
+import sys
+import json
+import pickle
+import hashlib
+import configparser
+from array import array
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.vocab import load_vocab
+
+
+STORE_ARRAYS = ["concepts", "path_offsets", "rels", "relset_offsets", "pair_qc", "pair_ac", "pair_found",
+                "pair_offsets", "statement_offsets"]
+
+
+def store_file(prefix, name):
+    return "%s.%s.npy" % (prefix, name)
+
+
+def is_pf_store(prefix):
+    marker = store_file(prefix, "statement_offsets")  # written last
+    if not os.path.exists(marker):
+        return False
+    # a legacy pickle newer than the store replaces it
+    return not os.path.exists(prefix + ".pickle") or os.path.getmtime(prefix + ".pickle") <= os.path.getmtime(marker)
+
+
+def scores_prefix(prefix, method="cls"):
+    return "%s.%s.scores" % (prefix, method)
+
+
+def load_pf(prefix, id2concept=None, threshold=None):
+    """
+    Opens path-finding results: the packed store at `prefix` if there is one and no newer pickle
+    `prefix.pickle`, else that pickle. Both can be indexed and iterated statement by statement in the legacy
+    layout.
+    :param threshold: if given, only paths whose score (from `scores_prefix(prefix)`) is at least `threshold`.
+    """
+    if is_pf_store(prefix):
+        print("loading packed paths from %s" % prefix)
+        pf_data = PFStore(prefix, id2concept=id2concept)
+        loaded_path = store_file(prefix, "statement_offsets")
+    else:
+        print("loading paths from %s" % (prefix + ".pickle"))
+        with open(prefix + ".pickle", "rb") as fi:
+            pf_data = pickle.load(fi)
+        loaded_path = prefix + ".pickle"
+    if os.path.exists(prefix + ".jsonl") and os.path.getmtime(prefix + ".jsonl") > os.path.getmtime(loaded_path):
+        print("warning: %s is newer than the paths loaded from %s, run `python pf_store.py from_jsonl %s`"
+              % (prefix + ".jsonl", loaded_path, prefix))
+    if threshold is None:
+        return pf_data
+    index = ScoreIndex(statement_path_offsets(pf_data),
+                       load_path_scores(scores_prefix(prefix), paths_fingerprint(pf_data)))
+    print("pruning paths at %s: keep rate %.4f" % (str(threshold), index.keep_rate(threshold)))
+    return PrunedPF(pf_data, index.statement_path_offsets, index.keep_mask(threshold))
+
+
+class PFStoreWriter(object):
+    """
+    Appends statements (legacy layout) one at a time; nothing but the flat int buffers is kept in memory.
+    :param concept2id: needed if the "qc"/"ac" fields are concept strings rather than ids.
+    """
+
+    def __init__(self, prefix, concept2id=None):
+        self.prefix = prefix
+        self.concept2id = concept2id
+        self.concepts = array("i")
+        self.path_offsets = array("q", [0])
+        self.rels = array("i")
+        self.relset_offsets = array("q", [0])
+        self.pair_qc = array("i")
+        self.pair_ac = array("i")
+        self.pair_found = array("b")
+        self.pair_offsets = array("q", [0])
+        self.statement_offsets = array("q", [0])
+
+    def _concept_id(self, c):
+        if isinstance(c, str):
+            return self.concept2id[c] if self.concept2id is not None else -1  # -1: unknown, not needed here
+        return int(c)
+
+    def add_statement(self, pfr_qa):
+        for qas in pfr_qa:
+            self.pair_qc.append(self._concept_id(qas["qc"]))
+            self.pair_ac.append(self._concept_id(qas["ac"]))
+            pf_res = qas["pf_res"]
+            self.pair_found.append(pf_res is not None)
+            for item in (pf_res or []):
+                self.concepts.extend(item["path"])
+                self.path_offsets.append(len(self.concepts))
+                for rel_list in item["rel"]:
+                    self.rels.extend(rel_list)
+                    self.relset_offsets.append(len(self.rels))
+            self.pair_offsets.append(len(self.path_offsets) - 1)
+        self.statement_offsets.append(len(self.pair_qc))
+
+    def arrays(self):
+        buffer_dtypes = {"i": np.int32, "q": np.int64, "b": np.int8}
+        res = {}
+        for name, dtype in [("concepts", np.int32), ("path_offsets", np.int64), ("rels", np.int32),
+                            ("relset_offsets", np.int64), ("pair_qc", np.int32), ("pair_ac", np.int32),
+                            ("pair_found", np.bool_), ("pair_offsets", np.int64), ("statement_offsets", np.int64)]:
+            buf = getattr(self, name)
+            res[name] = np.frombuffer(buf, dtype=buffer_dtypes[buf.typecode]).astype(dtype)
+        return res
+
+    def close(self):
+        for name, arr in self.arrays().items():
+            np.save(store_file(self.prefix, name), arr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+class PFStore(object):
+    """
+    Read-only, memory-mapped packed store. `store[i]` rebuilds statement i in the legacy layout on demand;
+    the array accessors (`statement_pairs`, `pair_paths`, `path`, `path_rels`) give lazy views without it.
+    :param id2concept: if given, "qc"/"ac" are returned as concept strings like in the pickle, else as ids.
+    """
+
+    def __init__(self, prefix, id2concept=None, mmap_mode="r", arrays=None):
+        self.prefix = prefix
+        self.id2concept = id2concept
+        for name in STORE_ARRAYS:
+            if arrays is not None:
+                setattr(self, name, arrays[name])
+            else:
+                setattr(self, name, np.load(store_file(prefix, name), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.statement_offsets) - 1
+
+    def statement_pairs(self, i):
+        return range(int(self.statement_offsets[i]), int(self.statement_offsets[i + 1]))
+
+    def pair_paths(self, j):
+        return range(int(self.pair_offsets[j]), int(self.pair_offsets[j + 1]))
+
+    def path(self, p):
+        return self.concepts[self.path_offsets[p]:self.path_offsets[p + 1]]
+
+    def path_rels(self, p):
+        hop_start = int(self.path_offsets[p]) - p
+        hop_end = int(self.path_offsets[p + 1]) - p - 1
+        bounds = self.relset_offsets[hop_start:hop_end + 1].tolist()
+        rels = self.rels[bounds[0]:bounds[-1]].tolist()
+        return [rels[lo - bounds[0]:hi - bounds[0]] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    def _concept(self, c):
+        return self.id2concept[c] if self.id2concept is not None else c
+
+    def statement(self, i):
+        pair_lo, pair_hi = int(self.statement_offsets[i]), int(self.statement_offsets[i + 1])
+        pair_offsets = self.pair_offsets[pair_lo:pair_hi + 1].tolist()
+        path_lo, path_hi = pair_offsets[0], pair_offsets[-1]
+        # one slice of every array per statement, then plain python lists
+        path_offsets = self.path_offsets[path_lo:path_hi + 1].tolist()
+        concepts = self.concepts[path_offsets[0]:path_offsets[-1]].tolist()
+        hop_offsets = [o - p for p, o in enumerate(path_offsets, path_lo)]
+        relset_offsets = self.relset_offsets[hop_offsets[0]:hop_offsets[-1] + 1].tolist()
+        rels = self.rels[relset_offsets[0]:relset_offsets[-1]].tolist()
+        c0, h0, r0 = path_offsets[0], hop_offsets[0], relset_offsets[0]
+
+        pfr_qa = []
+        for j in range(pair_lo, pair_hi):
+            if self.pair_found[j]:
+                pf_res = []
+                for p in range(pair_offsets[j - pair_lo] - path_lo, pair_offsets[j - pair_lo + 1] - path_lo):
+                    hops = relset_offsets[hop_offsets[p] - h0:hop_offsets[p + 1] - h0 + 1]
+                    pf_res.append({"path": concepts[path_offsets[p] - c0:path_offsets[p + 1] - c0],
+                                   "rel": [rels[lo - r0:hi - r0] for lo, hi in zip(hops[:-1], hops[1:])]})
+            else:
+                pf_res = None
+            pfr_qa.append({"ac": self._concept(int(self.pair_ac[j])), "qc": self._concept(int(self.pair_qc[j])),
+                           "pf_res": pf_res})
+        return pfr_qa
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.statement(k) for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.statement(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.statement(i)
+
+
+def statement_path_offsets(pf_data):
+    """
+    [num_statements + 1] offsets of each statement's paths in the flat path order (pair after pair).
+    """
+    if isinstance(pf_data, PFStore):
+        return np.asarray(pf_data.pair_offsets[np.asarray(pf_data.statement_offsets)], dtype=np.int64)
+    counts = [sum(len(qas["pf_res"] or []) for qas in pfr_qa) for pfr_qa in pf_data]
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def flatten_path_scores(all_scores):
+    """
+    all_scores[statement][pair] (list of path scores or None, as pickled by path_scoring) -> flat float array.
+    """
+    return np.array([score for statement_scores in all_scores for pair_scores in statement_scores
+                     for score in (pair_scores or [])], dtype=np.float64)
+
+
+def paths_fingerprint(pf_data):
+    """
+    Hash of the paths and their relations (what path scores depend on), in store order.
+    """
+    store = pack_statements(pf_data)
+    h = hashlib.sha1()
+    for arr in [store.concepts, store.path_offsets, store.rels, store.relset_offsets]:
+        h.update(memoryview(np.ascontiguousarray(arr)).cast("B"))
+    return h.hexdigest()
+
+
+def save_path_scores(prefix, path_scores, fingerprint):
+    np.savez(prefix + ".npz", scores=np.asarray(path_scores, dtype=np.float64), fingerprint=np.array(fingerprint))
+
+
+def load_path_scores(prefix, fingerprint=None):
+    """
+    :param fingerprint: `paths_fingerprint` of the paths the scores are for; scores computed for other paths
+    (the store was re-enumerated or re-packed since) are refused.
+    """
+    if os.path.exists(prefix + ".npz"):
+        saved = np.load(prefix + ".npz")
+        if fingerprint is not None and str(saved["fingerprint"]) != fingerprint:
+            raise ValueError("%s.npz was computed for other paths than the ones loaded, run path_scoring.py again"
+                             % prefix)
+        return saved["scores"]
+    print("warning: %s.pickle has no paths fingerprint, it is only checked against the number of paths" % prefix)
+    with open(prefix + ".pickle", "rb") as fi:
+        return flatten_path_scores(pickle.load(fi))
+
+
+class ScoreIndex(object):
+    """
+    All paths sorted once by decreasing score. The paths kept at any threshold are a prefix of that order, so
+    the masks and statistics of a whole list of thresholds cost one sort plus a binary search per threshold.
+    :param statement_path_offsets: see `statement_path_offsets`.
+    :param path_scores: one score per path, in store order.
+    """
+
+    def __init__(self, statement_path_offsets, path_scores):
+        self.statement_path_offsets = statement_path_offsets
+        self.path_scores = np.asarray(path_scores)
+        assert len(self.path_scores) == statement_path_offsets[-1]
+        self.order = np.argsort(-self.path_scores, kind="stable")
+        self.neg_sorted_scores = -self.path_scores[self.order]
+        self.rank = np.empty(len(self.order), dtype=np.int64)
+        self.rank[self.order] = np.arange(len(self.order))
+
+    def __len__(self):
+        return len(self.path_scores)
+
+    def num_kept(self, threshold):
+        return int(np.searchsorted(self.neg_sorted_scores, -threshold, side="right"))
+
+    def keep_rate(self, threshold):
+        return self.num_kept(threshold) / max(len(self), 1)
+
+    def keep_mask(self, threshold):
+        return self.rank < self.num_kept(threshold)
+
+    def statement_counts(self, threshold):
+        kept = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(self.keep_mask(threshold), out=kept[1:])
+        return np.diff(kept[self.statement_path_offsets])
+
+    def sweep(self, thresholds):
+        """
+        Keep statistics per threshold: kept paths, keep rate, and statements left without any path.
+        """
+        res = []
+        for threshold in thresholds:
+            counts = self.statement_counts(threshold)
+            res.append({"threshold": threshold, "kept": self.num_kept(threshold),
+                        "keep_rate": self.keep_rate(threshold), "empty_statements": int((counts == 0).sum())})
+        return res
+
+
+class PrunedPF(object):
+    """
+    Lazily filtered view of path-finding results: statement i is rebuilt from `pf_data[i]` with only the paths
+    whose entry in `keep` (a mask over all paths in store order) is set.
+    """
+
+    def __init__(self, pf_data, statement_path_offsets, keep):
+        self.pf_data = pf_data
+        self.statement_path_offsets = statement_path_offsets
+        self.keep = keep
+
+    def __len__(self):
+        return len(self.pf_data)
+
+    def statement(self, i):
+        keep = self.keep[self.statement_path_offsets[i]:self.statement_path_offsets[i + 1]].tolist()
+        pfr_qa = []
+        p = 0
+        for qas in self.pf_data[i]:
+            pf_res = qas["pf_res"]
+            if pf_res is not None:
+                pf_res = [item for k, item in enumerate(pf_res, p) if keep[k]]
+                p += len(qas["pf_res"])
+            pfr_qa.append({"ac": qas["ac"], "qc": qas["qc"], "pf_res": pf_res})
+        return pfr_qa
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.statement(k) for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.statement(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.statement(i)
+
+
+def pack_statements(pf_data, concept2id=None):
+    """
+    In-memory packed view of statements in the legacy layout, for code that works on the flat arrays.
+    """
+    if isinstance(pf_data, PFStore):
+        return pf_data
+    writer = PFStoreWriter(None, concept2id)
+    for pfr_qa in pf_data:
+        writer.add_statement(pfr_qa)
+    return PFStore(None, arrays=writer.arrays())
+
+
+def jsonl_to_store(jsonl_path, prefix, concept2id):
+    with PFStoreWriter(prefix, concept2id) as writer, open(jsonl_path, "r", encoding="utf8") as f:
+        for line in tqdm(f, desc="packing %s" % jsonl_path):
+            writer.add_statement(json.loads(line))
+
+
+def pickle_to_store(pickle_path, prefix, concept2id):
+    with open(pickle_path, "rb") as fi:
+        pf_data = pickle.load(fi)
+    with PFStoreWriter(prefix, concept2id) as writer:
+        for pfr_qa in tqdm(pf_data, desc="packing %s" % pickle_path):
+            writer.add_statement(pfr_qa)
+
+
+def store_to_pickle(prefix, pickle_path, id2concept):
+    store = PFStore(prefix, id2concept=id2concept)
+    with open(pickle_path, "wb") as fo:
+        pickle.dump(list(tqdm(store, total=len(store), desc="unpacking %s" % prefix)), fo,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    if pickle_path == prefix + ".pickle":  # same content: keep load_pf on the store
+        store_mtime = os.path.getmtime(store_file(prefix, "statement_offsets"))
+        os.utime(pickle_path, (store_mtime, store_mtime))
+
+
+def load_concept_vocab():
+    config = configparser.ConfigParser()
+    config.read("paths.cfg")
+    concept_vocab = load_vocab(config["paths"]["concept_vocab"])
+    return concept_vocab.to_dict(), concept_vocab.id2word  # dict: packing looks up every (qc, ac) pair
+
+
+# python pf_store.py from_jsonl ../datasets/csqa_new/train_rand_split.jsonl.statements.mcp.pf
+# python pf_store.py from_pickle ../datasets/csqa_new/train_rand_split.jsonl.statements.mcp.pf
+# python pf_store.py to_pickle ../datasets/csqa_new/train_rand_split.jsonl.statements.mcp.pf
+if __name__ == "__main__":
+    cmd, prefix = sys.argv[1], sys.argv[2]
+    concept2id, id2concept = load_concept_vocab()
+    if cmd == "from_jsonl":
+        jsonl_to_store(prefix + ".jsonl", prefix, concept2id)
+    elif cmd == "from_pickle":
+        pickle_to_store(prefix + ".pickle", prefix, concept2id)
+    elif cmd == "to_pickle":
+        store_to_pickle(prefix, prefix + ".pickle", id2concept)